@@ -10,7 +10,7 @@ from utils.animation import read_coordinates
 from utils.colors import decode_rgb
 import tkinter
 
-from utils.coords import Coord3d
+from utils.coords import CoordinateStore
 
 TARGET_FPS = 60
 TARGET_REFRESH = 1 / TARGET_FPS
@@ -26,12 +26,10 @@ blank_frame_count = 0
 
 tree_coordinates_file = os.path.join("treehero", "data", "coordinates.tree")
 
-coords: dict[int, Coord3d] = read_coordinates(tree_coordinates_file)
+coords: CoordinateStore = read_coordinates(tree_coordinates_file)
 
-min_x = min(map(lambda x: x.x, coords.values())) * SCALING
-max_x = max(map(lambda x: x.x, coords.values())) * SCALING
-min_z = min(map(lambda x: x.z, coords.values())) * SCALING
-max_z = max(map(lambda x: x.z, coords.values())) * SCALING
+min_x, _, min_z = coords.min() * SCALING
+max_x, _, max_z = coords.max() * SCALING
 
 
 class LightsServicer(lights_pb2_grpc.LightsServicer):
@@ -8,16 +8,22 @@
 
 import time
 import argparse
+import json
 import os
 import sys
+from concurrent import futures
+from concurrent.futures import ThreadPoolExecutor
+
 import cv2
 
-import board
-import neopixel
+from utils import frame_archive, gray_code
+from utils.camera import ThreadedCamera
+from utils.coordinate_cache import load_points
+from utils.simulator import TreeSimulator
 
 # LED strip configuration:
 LED_COUNT = 500  # Number of LED pixels.
-LED_PIN = board.D18  # GPIO pin connected to the pixels (18 uses PWM!).
+LED_PIN = "D18"  # GPIO pin connected to the pixels (18 uses PWM!).
 # LED_PIN       = 10      # GPIO pin connected to the pixels (10 uses SPI /dev/spidev0.0).
 LED_FREQ_HZ = 800000  # LED signal frequency in hertz (usually 800khz)
 LED_DMA = 10  # DMA channel to use for generating signal (try 10)
@@ -60,18 +66,27 @@ def wheel(pos):
         return (0, pos * 3, 255 - pos * 3)
 
 
-def one_by_one(strip, cam, folder="captures", angle=0, wait_ms=500, dry_run=False, start=0):
-    """Lights up the strand one pixel at a time."""
+def one_by_one(strip, cam, folder="captures", angle=0, wait_ms=500, dry_run=False, start=0, archive=False):
+    """
+    Lights up the strand one pixel at a time. With `archive`, the images are saved as gray-scale frames cropped to the
+    tree in a single `frames_angle###.frames` file instead of a jpeg per led.
+    """
+    writer = _open_archive(strip, cam, folder, angle, wait_ms) if archive and not dry_run else None
+    pending = []
     fill(strip)
 
     for i in range(start, strip.n):
         strip[i] = LED_WHITE
         strip.show()
+        shown = time.perf_counter()
         time.sleep(wait_ms / 1000.0)
 
-        if not dry_run:
+        if writer:
+            _, img = cam.frame_after(shown)
+            pending.append(cam.submit(lambda upright, led_id=i: writer.append(led_id, upright), img))
+        elif not dry_run:
             filename = os.path.join(folder, f"led{i:03}_angle{angle:03}.jpg")
-            _capture_image(cam, filename)
+            _capture_image(cam, filename, after=shown)
 
         strip[i] = LED_OFF
         strip.show()
@@ -86,26 +101,142 @@ def one_by_one(strip, cam, folder="captures", angle=0, wait_ms=500, dry_run=Fals
     fill(strip)
     time.sleep(wait_ms / 1000.0)
 
+    if writer:
+        # Waits for the frames still being written.
+        futures.wait(pending)
+        writer.close()
 
-def _capture_image(cam, filename):
+
+def _open_archive(strip, cam, folder, angle, wait_ms=500):
+    """Opens the frame archive for the angle, cropped to where the leds are when they are all lit."""
+    fill(strip, color=LED_WHITE)
+    time.sleep(wait_ms / 1000.0)
+    _, lit = cam.frame_after()
+    fill(strip)
+    time.sleep(wait_ms / 1000.0)
+    _, dark = cam.frame_after()
+
+    lit, dark = cam.orient(lit), cam.orient(dark)
+    roi = frame_archive.find_roi(lit, dark)
+    writer = frame_archive.FrameArchiveWriter(os.path.join(folder, frame_archive.archive_file_name(angle)), roi,
+                                              lit.shape[:2])
+    print(f"Archiving {writer.width}x{writer.height} frames at ({writer.x}, {writer.y})")
+    return writer
+
+
+def gray_code_capture(strip, cam, folder="captures", angle=0, wait_ms=500, dry_run=False, start=0, end=None):
+    """
+    Captures the structured light images for one angle. Each image lights the leds whose Gray coded id has one bit
+    set, followed by its inverse. Along with the dark and all leds images, that is 2 * log2(n) + 2 images instead of
+    n. `python3 -m utils.gray_code` decodes them.
+    """
+    end = end if end else strip.n
+    led_ids = list(range(start, end))
+    frames = [(None, False)] + [(bit, inverse) for bit in range(gray_code.bit_count(end)) for inverse in [False, True]]
+
+    for bit, inverse in frames:
+        lit = [True] * len(led_ids) if bit is None else gray_code.pattern(led_ids, bit, inverse)
+        fill(strip)
+        for led_id, on in zip(led_ids, lit):
+            strip[led_id] = LED_WHITE if on else LED_OFF
+        strip.show()
+        time.sleep(wait_ms / 1000.0)
+
+        if not dry_run:
+            file_name = f"leds_angle{angle:03}.jpg" if bit is None else gray_code.pattern_file_name(bit, angle, inverse)
+            _capture_image(cam, os.path.join(folder, file_name))
+
+    fill(strip)
+    time.sleep(wait_ms / 1000.0)
+    if not dry_run:
+        _capture_dark(cam, folder, angle=angle)
+
+
+def video_capture(strip, cam, folder="captures", angle=0, period_ms=100, sync_ms=1000, dry_run=False, start=0,
+                  end=None):
+    """
+    Records a video while the strand lights one pixel at a time on a fixed schedule. This is much faster than
+    `one_by_one` since there is no waiting for the camera between leds.
+
+    The schedule is: every led on for `sync_ms` (the sync flash), every led off for `sync_ms`, then each led from
+    `start` to `end` for `period_ms`. The video is saved as `video_angle###.avi` with the schedule and the time each
+    frame was read in `video_angle###.json`. `python3 -m utils.video_decode` turns them into the usual
+    `led###_angle###.jpg` images.
+    """
+    end = end if end else strip.n
+    period = period_ms / 1000.0
+    sync = sync_ms / 1000.0
+    leds_start = 2 * sync
+    # One extra dark slot at the end so the last led isn't cut off.
+    duration = leds_start + (end - start + 1) * period
+
+    writer = None
+    # Encoding runs on its own thread so the strip keeps to the schedule.
+    encoder = ThreadPoolExecutor(max_workers=1)
+    timestamps = []
+    state = None
+    last = float("-inf")
+    t0 = time.perf_counter()
+    while True:
+        now = time.perf_counter() - t0
+        if now >= duration:
+            break
+
+        new_state = _video_state(now, sync, leds_start, period, start, end)
+        if new_state != state:
+            if new_state == "sync":
+                fill(strip, color=LED_WHITE)
+            elif new_state == "dark":
+                fill(strip)
+            else:
+                if isinstance(state, int):
+                    strip[state] = LED_OFF
+                strip[new_state] = LED_WHITE
+                strip.show()
+            state = new_state
+
+        if dry_run or not cam:
+            time.sleep(.01)
+            continue
+
+        last, img = cam.frame_after(last)
+        if writer is None:
+            fps = cam.get(cv2.CAP_PROP_FPS) or 30
+            writer = cv2.VideoWriter(os.path.join(folder, f"video_angle{angle:03}.avi"),
+                                     cv2.VideoWriter_fourcc(*"MJPG"), fps, (img.shape[1], img.shape[0]))
+        encoder.submit(writer.write, img)
+        timestamps.append(last - t0)
+
+    fill(strip)
+    encoder.shutdown(wait=True)
+    if writer:
+        writer.release()
+        with open(os.path.join(folder, f"video_angle{angle:03}.json"), 'w') as f:
+            json.dump({"angle": angle, "start": start, "end": end, "period": period, "sync": sync,
+                       "leds_start": leds_start, "rotate": True, "timestamps": timestamps}, f)
+        print(f"Captured {len(timestamps)} frames in {duration:.1f}s for angle {angle}")
+
+
+def _video_state(now, sync, leds_start, period, start, end):
+    """Returns what should be lit `now` seconds into a video capture. Either "sync", "dark" or the led index."""
+    if now < sync:
+        return "sync"
+    if now < leds_start:
+        return "dark"
+    led = start + int((now - leds_start) / period)
+    return led if led < end else "dark"
+
+
+def _capture_image(cam, filename, after=None):
+    """
+    Saves the first frame the camera took after `after` (a time.perf_counter() value, defaults to now). The camera is
+    read continuously in the background so the frame is never a stale one from the driver's buffer, and the image is
+    written in the background as well.
+    """
     if cam:
-        while True:
-            # Calls the 'read' method several times. For some reason,
-            # this would occasionally give me the same frame as the previous image.
-            # I tried diffing images but it proved to be difficult. Instead,
-            # Calling read several times seems to 'flush the buffer' or something
-            # so that we get a fresh image from the camera.
-            s, img = cam.read()
-            s, img = cam.read()
-            s, img = cam.read()
-            s, img = cam.read()
-            s, img = cam.read()
-            s, img = cam.read()
-            if s:  # frame captured without any errors
-                print(f"Writing file {filename}")
-                img = cv2.rotate(img, cv2.ROTATE_90_COUNTERCLOCKWISE)
-                cv2.imwrite(filename, img)  # save image
-                break
+        _, img = cam.frame_after(after)
+        print(f"Writing file {filename}")
+        cam.save(filename, img)
 
 
 def _capture_reference(cam, folder, angle=None):
@@ -113,13 +244,27 @@ def _capture_reference(cam, folder, angle=None):
     _capture_image(cam, file_name)
 
 
+def _capture_dark(cam, folder, angle=None):
+    """Captures the tree with every led off. s2 subtracts it from the led images to remove the background."""
+    file_name = os.path.join(folder, f"dark_{angle:03}.jpg")
+    _capture_image(cam, file_name)
+
+
+def _strip():
+    """The real led strip. Imported here so everything else runs on machines without the Raspberry Pi libraries."""
+    import board
+    import neopixel
+
+    return neopixel.NeoPixel(getattr(board, LED_PIN), LED_COUNT, brightness=LED_BRIGHTNESS, auto_write=False)
+
+
 def _cam(focus=0):
     cam = cv2.VideoCapture(0, cv2.CAP_V4L2)
     cam.set(cv2.CAP_PROP_AUTOFOCUS, 0)  # turn off autofocus
     cam.set(cv2.CAP_PROP_FOCUS, focus)
     cam.set(3, 1920)  # Set Width
     cam.set(4, 1080)  # Set Height
-    return cam
+    return ThreadedCamera(cam, rotate=cv2.ROTATE_90_COUNTERCLOCKWISE)
 
 
 def _focus(strip):
@@ -139,6 +284,8 @@ def _focus(strip):
         file_name = os.path.join(folder, f"f_{f:03}.jpg")
         _capture_image(cam, file_name)
 
+    cam.close()
+
 
 def main():
     # Process arguments
@@ -149,9 +296,28 @@ def main():
     parser.add_argument('-s', '--start-index', type=int, default=0, help='The index of the first LED to use.')
     parser.add_argument('-e', '--end-index', type=int, default=LED_COUNT, help='The index of the last LED to use.')
     parser.add_argument('-l', '--light', action='store_true', help='The light the tree for testing')
+    parser.add_argument('-v', '--video', action='store_true',
+                        help='Records a video of the leds lighting on a schedule instead of an image per led.')
+    parser.add_argument('--period-ms', type=int, default=100, help='How long each led is lit in video mode.')
+    parser.add_argument('-g', '--gray-code', action='store_true',
+                        help='Captures Gray coded images of many leds at once instead of an image per led.')
+    parser.add_argument('-a', '--archive', action='store_true',
+                        help='Saves the led images to one cropped gray-scale archive per angle instead of jpegs.')
+    parser.add_argument('-w', '--wait-ms', type=int, default=500, help='How long to wait after lighting leds.')
+    parser.add_argument('-o', '--output-folder', type=str, default="tree_captures",
+                        help='The folder the images are saved to.')
+    parser.add_argument('--simulate', type=str, metavar='COORDS_FILE',
+                        help='Captures a simulated tree with the given coordinates instead of the strip and camera.')
+    parser.add_argument('--simulate-focal', type=float, metavar='PX',
+                        help='The focal length of the simulated camera. Defaults to an orthographic camera.')
     args = parser.parse_args()
 
-    strip = neopixel.NeoPixel(LED_PIN, LED_COUNT, brightness=LED_BRIGHTNESS, auto_write=False)
+    simulator = None
+    if args.simulate:
+        simulator = TreeSimulator(load_points(args.simulate), focal=args.simulate_focal)
+        strip = simulator.strip
+    else:
+        strip = _strip()
     strip.show()  # Turn off all the pixels
 
     print('Press Ctrl-C to quit.')
@@ -168,13 +334,17 @@ def main():
     if not args.persist:
         print('Use "-p" argument to keep LEDs lit on exit')
 
+    cam = None
     try:
-        folder = "tree_captures"
+        folder = args.output_folder
         if not os.path.exists(folder):
             os.makedirs(folder)
 
         angles = [0, 45, 90, 135, 180, 225, 270, 315]
-        cam = _cam()
+        if simulator:
+            cam = ThreadedCamera(simulator.camera, rotate=cv2.ROTATE_90_COUNTERCLOCKWISE)
+        else:
+            cam = _cam()
         #         time.sleep(5) # Wait 10 seconds to make sure the camera is ready
 
         for a in angles:
@@ -185,17 +355,40 @@ def main():
             strip[60] = (0, 0, 255)
             strip.show()
 
+            if simulator:
+                # No one needs to turn the tree.
+                simulator.angle = a
+                prompt = print
+            else:
+                prompt = input
+
             if not args.dry_run:
-                input(f"Press Enter to capture lights-on image {a} degrees.")
+                prompt(f"Press Enter to capture lights-on image {a} degrees.")
                 _capture_reference(cam, folder, angle=a)
                 fill(strip)
-
-            input(f"Press Enter to capture tree at {a} degrees.")
-            one_by_one(strip, cam, folder=folder, angle=a, dry_run=args.dry_run, start=args.start_index)
+                time.sleep(args.wait_ms / 1000.0)
+                _capture_dark(cam, folder, angle=a)
+
+            prompt(f"Press Enter to capture tree at {a} degrees.")
+            angle_start = time.perf_counter()
+            if args.gray_code:
+                gray_code_capture(strip, cam, folder=folder, angle=a, wait_ms=args.wait_ms, dry_run=args.dry_run,
+                                  start=args.start_index, end=args.end_index)
+            elif args.video:
+                video_capture(strip, cam, folder=folder, angle=a, period_ms=args.period_ms, dry_run=args.dry_run,
+                              start=args.start_index, end=args.end_index)
+            else:
+                one_by_one(strip, cam, folder=folder, angle=a, wait_ms=args.wait_ms, dry_run=args.dry_run,
+                           start=args.start_index, archive=args.archive)
+            print(f"Captured {a} degrees in {time.perf_counter() - angle_start:.1f}s")
 
     except KeyboardInterrupt:
         # Catch interrupt
         pass
+    finally:
+        if cam:
+            # Waits for the last images to be written.
+            cam.close()
 
     print()
     if not args.persist:
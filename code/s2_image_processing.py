@@ -1,10 +1,18 @@
+from collections import namedtuple
 from datetime import datetime
-import time
+from functools import lru_cache
+from multiprocessing import Pool
+import re
+import signal
 
 from utils.coords import Coord2d
+from utils.detection_cache import DetectionCache, detection_key
+from utils.frame_archive import FrameArchive, archive_file_name
+from utils.progress import Progress
 from utils import continuation as c
 
 import cv2
+import numpy as np
 import os
 import argparse
 
@@ -22,22 +30,141 @@ components:
 THRESHOLD_VALUE = 40
 # Radius must be odd for GaussianBlur
 RADIUS = 11
+# The factor the image is shrunk by to find the led before refining the location at full resolution.
+COARSE_SCALE = 4
+# Half the size of the full resolution window around the coarse location that is searched for the led.
+ROI_RADIUS = 2 * COARSE_SCALE + RADIUS
+# The number of bright spots on the downscaled image that are checked at full resolution. A single bright pixel or
+# a large dim light (a lamp, a window) can outshine the led on the downscaled image but not once it's blurred.
+COARSE_CANDIDATES = 5
+ANGLES = [0, 45, 90, 135, 180, 225, 270, 315]
+# Bump when the detection logic changes so cached results are not reused.
+DETECTOR_VERSION = 4
+# The number of led images per angle whose median is used as the background when there is no dark image.
+MEDIAN_SAMPLES = 25
+# The number of images from one angle that are stacked and evaluated together by the background detector.
+BATCH_SIZE = 16
 
 
-def detect_light_location(file_name):
+def _find_light_full(image):
+    processed_image = cv2.GaussianBlur(image, (RADIUS, RADIUS), 0)
+    (_, maxVal, _, maxLoc) = cv2.minMaxLoc(processed_image)
+    return maxLoc, maxVal, None, processed_image
+
+
+def _find_light_coarse(image):
+    loc, maxVal, confidence = find_light(image)
+    return loc, maxVal, confidence, image
+
+
+def find_light(image):
+    """
+    Finds the brightest area of a gray-scale image coarse to fine. Returns a tuple of [x, y], value, confidence where
+    value is the same as the max of the full image blurred by RADIUS.
+    """
+    return _best_candidate(image, _shrink(image))
+
+
+def find_lights(stack, background):
+    """
+    Batch version of `find_light` for a (B, H, W) stack of gray-scale images taken from the same angle. The
+    background is subtracted from every image first so ambient light and bright spots that don't change between
+    images (windows, lamps, reflections) are ignored. Returns a list of ([x, y], value, confidence) and the
+    background subtracted stack.
+    """
+    diff = np.subtract(stack, background, dtype=np.int16)
+    np.clip(diff, 0, 255, out=diff)
+    diff = diff.astype(np.uint8)
+
+    results = [_best_candidate(image, image_small) for image, image_small in zip(diff, _shrink(diff))]
+    return results, diff
+
+
+def _shrink(images):
     """
-    Reach an image from file, converts it to gray-scale and then finds the brightest area.
-    Returns a tuple of [x, y], value, image.
+    Downscales an (H, W) image or a (B, H, W) stack by COARSE_SCALE keeping the brightest pixel of every block.
+    Averaging the blocks (INTER_AREA) dims a small led below large dim lights, the max keeps its peak.
     """
+    height, width = images.shape[-2:]
+    images = images[..., :height - height % COARSE_SCALE, :width - width % COARSE_SCALE]
+    # The max of strided views is much faster than reducing a reshaped block axis.
+    rows = np.maximum.reduce([images[..., i::COARSE_SCALE, :] for i in range(COARSE_SCALE)])
+    return np.maximum.reduce([rows[..., i::COARSE_SCALE] for i in range(COARSE_SCALE)])
+
+
+def _best_candidate(image, small):
+    """
+    Refines the brightest spots of the downscaled image at full resolution and returns the [x, y], value, confidence
+    of the brightest one. The confidence compares it to the runner up. An isolated led scores close to 1 while an image
+    with a second light of the same brightness (a reflection, a lamp) scores close to 0.
+    """
+    refined = sorted((_refine(image, cx, cy) for cx, cy in _coarse_candidates(small)), key=lambda r: r[1],
+                     reverse=True)
+    loc, peak = refined[0]
+    second = refined[1][1] if len(refined) > 1 else 0
+    confidence = round(1 - second / peak, 3) if peak > 0 else 0.0
+    return loc, peak, confidence
+
+
+def _coarse_candidates(small, count=COARSE_CANDIDATES):
+    """Returns the full resolution (x, y) of the brightest spots on a downscaled image that are apart from each other.
+    """
+    small = small.copy()
+    window = ROI_RADIUS // COARSE_SCALE + 1
+
+    candidates = []
+    for _ in range(count):
+        (_, peak, _, (sx, sy)) = cv2.minMaxLoc(small)
+        if candidates and peak <= 0:
+            break
+        candidates.append((sx * COARSE_SCALE + COARSE_SCALE // 2, sy * COARSE_SCALE + COARSE_SCALE // 2))
+        # Mask out the spot before looking for the next one.
+        small[max(sy - window, 0):sy + window + 1, max(sx - window, 0):sx + window + 1] = 0
+    return candidates
+
+
+def _refine(image, cx, cy):
+    """Finds the brightest spot of the full resolution image in a window around the coarse (cx, cy) location."""
+    height, width = image.shape
+
+    # Blur a window around the candidate. The window is padded by the kernel so the pixels that are searched match a
+    # blur of the whole image.
+    pad = RADIUS // 2
+    x0, x1 = max(cx - ROI_RADIUS - pad, 0), min(cx + ROI_RADIUS + pad + 1, width)
+    y0, y1 = max(cy - ROI_RADIUS - pad, 0), min(cy + ROI_RADIUS + pad + 1, height)
+    roi = cv2.GaussianBlur(image[y0:y1, x0:x1], (RADIUS, RADIUS), 0)
+
+    ix0, iy0 = (pad if x0 > 0 else 0), (pad if y0 > 0 else 0)
+    ix1, iy1 = roi.shape[1] - (pad if x1 < width else 0), roi.shape[0] - (pad if y1 < height else 0)
+    (_, maxVal, _, (mx, my)) = cv2.minMaxLoc(roi[iy0:iy1, ix0:ix1])
+    mx, my = mx + ix0, my + iy0
 
-    image = cv2.imread(file_name)
+    dx, dy = _centroid_offset(roi, mx, my)
+    return (round(x0 + mx + dx, 2), round(y0 + my + dy, 2)), maxVal
 
-    processed_image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    processed_image = cv2.GaussianBlur(processed_image, (RADIUS, RADIUS), 0)
-    # ret, processed_image = cv2.threshold(processed_image, THRESHOLD_VALUE, 255, cv2.THRESH_TOZERO)
-    (minVal, maxVal, minLoc, maxLoc) = cv2.minMaxLoc(processed_image)
 
-    return maxLoc, maxVal, processed_image
+def _centroid_offset(image, x, y, radius=RADIUS // 2):
+    """Returns the offset from (x, y) to the brightness weighted centroid of the bright pixels around it."""
+    window = image[max(y - radius, 0):y + radius + 1, max(x - radius, 0):x + radius + 1].astype(np.float32)
+
+    # Only weight pixels that are brighter than half the peak so the background doesn't pull the centroid.
+    weights = np.clip(window - (window.max() + window.min()) / 2, 0, None)
+    total = weights.sum()
+    if total <= 0:
+        return 0, 0
+
+    rows, cols = np.indices(window.shape)
+    return (float((weights * cols).sum() / total) - (x - max(x - radius, 0)),
+            float((weights * rows).sum() / total) - (y - max(y - radius, 0)))
+
+
+# Each detector takes a gray-scale image and returns [x, y], value, confidence, image
+DETECTORS = {
+    "full": _find_light_full,
+    "coarse": _find_light_coarse,
+    # Handled in batches by `process_batch`
+    "background": None,
+}
 
 
 def save_image(image, folder, filename):
@@ -51,14 +178,236 @@ def save_image(image, folder, filename):
     cv2.imwrite(full_filename, image)
 
 
+# `input_file_name` is either the led's jpeg or the frame archive of the angle.
+Job = namedtuple('Job', 'led_id angle input_file_name out_folder detector save_image', defaults=[False])
+Batch = namedtuple('Batch', 'jobs background_file')
+IMAGE_FILE_PATTERN = re.compile(r"led(\d+)_angle(\d+)\.jpg")
+
+
+def read_image(job: Job):
+    """
+    Returns the gray-scale image for the job and the (x, y) of its top left corner in the full camera image. Frames
+    from an archive are cropped to the tree so the corner is not (0, 0).
+    """
+    if job.input_file_name.endswith(".frames"):
+        archive = _open_archive(job.input_file_name)
+        return archive.frame(job.led_id), archive.origin
+    return cv2.imread(job.input_file_name, cv2.IMREAD_GRAYSCALE), (0, 0)
+
+
+@lru_cache(maxsize=None)
+def _open_archive(file_name):
+    return FrameArchive(file_name)
+
+
+def process_image(job: Job):
+    """
+    Finds the led in a single image. If the job asks for it, a copy of the image with the led circled is saved.
+    Returns the Coord2d of the led.
+    """
+    image, origin = read_image(job)
+    loc, maxVal, confidence, processed_image = DETECTORS[job.detector](image)
+    return _mark_light(job, processed_image, origin, loc, maxVal, confidence)
+
+
+def process_batch(batch: Batch):
+    """
+    Finds the led in every image of the batch. Returns the list of Coord2d. Batches with a background are evaluated
+    together on a stack of the background subtracted images; the rest are processed one image at a time.
+    """
+    if batch.background_file is None:
+        return [process_image(job) for job in batch.jobs]
+
+    background = cv2.imread(batch.background_file, cv2.IMREAD_GRAYSCALE)
+    images, origins = zip(*map(read_image, batch.jobs))
+    detections, processed_images = find_lights(np.stack(images), background)
+    return [_mark_light(job, processed_image, origin, *detection)
+            for job, detection, processed_image, origin in zip(batch.jobs, detections, processed_images, origins)]
+
+
+def _mark_light(job, processed_image, origin, loc, maxVal, confidence):
+    """
+    Saves the image with the led circled if the job asks for it and returns the Coord2d of the led in the full camera
+    image.
+    """
+    if job.save_image:
+        # Archive frames are read only.
+        processed_image = np.array(processed_image)
+        cv2.circle(processed_image, (int(round(loc[0])), int(round(loc[1]))), RADIUS, (255, 0, 0), 2)
+        save_image(processed_image, job.out_folder, processed_file_name(job.led_id, job.angle))
+
+    return Coord2d(job.led_id, job.angle, loc[0] + origin[0], loc[1] + origin[1], maxVal, confidence)
+
+
+def processed_file_name(led_id, angle):
+    return f"led{led_id:03}_angle{angle:03}_processed.jpg"
+
+
+def view_image(input_folder, out_folder, led_id, angle, detector="full"):
+    """
+    Regenerates the image with the led circled for a single led / angle without reprocessing the rest of the images.
+    Returns the Coord2d of the led or None if there is no image for it.
+    """
+    sources = find_images(input_folder)[angle]
+    if led_id not in sources:
+        print(f"No image for led {led_id} at {angle} degrees in {input_folder}.")
+        return None
+
+    job = Job(led_id, angle, sources[led_id], out_folder, detector, save_image=True)
+    if detector != "background":
+        return process_image(job)
+
+    angle_jobs = [Job(i, angle, file_name, out_folder, detector) for i, file_name in sorted(sources.items())]
+    background = build_background(input_folder, angle, angle_jobs)
+    image, origin = read_image(job)
+    (detection,), (processed_image,) = find_lights(image[np.newaxis], background)
+    return _mark_light(job, processed_image, origin, *detection)
+
+
+def find_images(input_folder):
+    """
+    Returns a map of angle to a map of led id to the file with its image. Frame archives (see s1 `--archive`) are used
+    for an angle if there is one, otherwise the `led###_angle###.jpg` images. The folder is only listed once.
+    """
+    files = os.listdir(input_folder)
+    images = {angle: {} for angle in ANGLES}
+    for file_name in files:
+        match = IMAGE_FILE_PATTERN.fullmatch(file_name)
+        if match and int(match.group(2)) in images:
+            images[int(match.group(2))][int(match.group(1))] = os.path.join(input_folder, file_name)
+
+    for angle in ANGLES:
+        if archive_file_name(angle) in files:
+            archive_file = os.path.join(input_folder, archive_file_name(angle))
+            images[angle] = {led_id: archive_file for led_id in _open_archive(archive_file).led_ids}
+    return images
+
+
+def find_jobs(input_folder, out_folder, start_index, end_index, detector="full", save_images=False):
+    """Returns the list of images to process ordered by led and then angle."""
+    images = find_images(input_folder)
+    jobs = []
+    for i in range(start_index, end_index):
+        for angle in ANGLES:
+            if i not in images[angle]:
+                print(f"Skipping led {i} at {angle} degrees. Image not found.")
+                continue
+            jobs.append(Job(i, angle, images[angle][i], out_folder, detector, save_images))
+    return jobs
+
+
+def build_background(input_folder, angle, jobs):
+    """
+    Returns the gray-scale image of the tree with every led off from the given angle, in the same frame as the jobs'
+    images. Uses the `dark_###.jpg` captured by s1 if there is one. Otherwise it is the per pixel median of a sample of
+    the led images for the angle. Each led only lights a small part of an image so the median is the unlit scene. The
+    reference images can't be used as they have several leds lit.
+    """
+    dark_file_name = os.path.join(input_folder, f"dark_{angle:03}.jpg")
+    if os.path.exists(dark_file_name):
+        image, (x, y) = read_image(jobs[0])
+        height, width = image.shape
+        return cv2.imread(dark_file_name, cv2.IMREAD_GRAYSCALE)[y:y + height, x:x + width]
+
+    samples = jobs[::max(len(jobs) // MEDIAN_SAMPLES, 1)][:MEDIAN_SAMPLES]
+    stack = np.stack([read_image(job)[0] for job in samples])
+    return np.median(stack, axis=0).astype(np.uint8)
+
+
+def build_backgrounds(input_folder, out_folder, jobs):
+    """Builds and saves the background for every angle in the jobs. Returns a map of angle to background file."""
+    backgrounds = {}
+    for angle in sorted({job.angle for job in jobs}):
+        angle_jobs = [job for job in jobs if job.angle == angle]
+        background_file_name = os.path.join(out_folder, f"background_{angle:03}.png")
+        cv2.imwrite(background_file_name, build_background(input_folder, angle, angle_jobs))
+        backgrounds[angle] = background_file_name
+    return backgrounds
+
+
+def make_batches(jobs, backgrounds=None):
+    """
+    Groups the jobs into batches of images from the same angle. Jobs for an angle with a background are batched by
+    BATCH_SIZE so the images can be stacked.
+    """
+    backgrounds = backgrounds or {}
+    batches = []
+    for angle in ANGLES:
+        angle_jobs = [job for job in jobs if job.angle == angle]
+        size = BATCH_SIZE if angle in backgrounds else 4
+        for i in range(0, len(angle_jobs), size):
+            batches.append(Batch(angle_jobs[i:i + size], backgrounds.get(angle)))
+    return batches
+
+
+def process_jobs(batches, workers=1):
+    """
+    Yields the list of Coord2d for each batch as it completes. With more than one worker, the batches are processed
+    in a pool of processes.
+    """
+    if workers <= 1:
+        yield from map(process_batch, batches)
+        return
+
+    with Pool(workers, initializer=_init_worker) as pool:
+        yield from pool.imap_unordered(process_batch, batches)
+
+
+def detector_params(detector):
+    """The settings that affect detection results. Cached detections are only reused if these match."""
+    params = {"version": DETECTOR_VERSION, "radius": RADIUS, "threshold": THRESHOLD_VALUE, "detector": detector}
+    if detector in ["coarse", "background"]:
+        params.update({"coarse_scale": COARSE_SCALE, "roi_radius": ROI_RADIUS})
+    if detector == "background":
+        params.update({"median_samples": MEDIAN_SAMPLES})
+    return params
+
+
+def hash_jobs(jobs, params, backgrounds=None, workers=1):
+    """
+    Returns a map of (led_id, angle) to the cache key of every job. Reading and hashing the images is split between
+    `workers` processes the same as the detection.
+    """
+    backgrounds = backgrounds or {}
+    tasks = [(params, job, backgrounds.get(job.angle)) for job in jobs]
+    if workers <= 1:
+        keys = map(_cache_key, tasks)
+    else:
+        with Pool(workers, initializer=_init_worker) as pool:
+            keys = pool.map(_cache_key, tasks, chunksize=16)
+    return {(job.led_id, job.angle): key for job, key in zip(jobs, keys)}
+
+
+def _cache_key(task):
+    """Archived frames are hashed on their own instead of hashing the whole archive."""
+    params, job, background_file_name = task
+    if job.input_file_name.endswith(".frames"):
+        image, origin = read_image(job)
+        return detection_key(params, image, background_file_name, salt=str(origin))
+    return detection_key(params, job.input_file_name, background_file_name)
+
+
+def _init_worker():
+    # Let the main process handle Ctrl-C and keep OpenCV from spawning its own threads in every worker.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    cv2.setNumThreads(1)
+
+
 def main():
     """
     Executes the processing of jpeg images to coordinates in each image. The result is a CSV with id,angle,x,y columns.
     Flags:
       -s (optional) the start index of the first LED. Ex: 10
       -e (optional)the end index of the last LED to use (exclusive). Ex: 249
-      -i the relative folder of the input files. Images are expected to be named like `led###_angle###.jpg`
+      -i the relative folder of the input files. Images are expected to be named like `led###_angle###.jpg` or be in
+         `frames_angle###.frames` archives.
       -i the relative folder of the output file(s). Images are output as `led###_angle###_processed.jpg
+      -j (optional) the number of processes to use. Ex: 4
+      -d (optional) the detector to use. Ex: background
+      --cache-folder (optional) where cached detections are kept. Defaults to <output folder>/cache
+      --save-images (optional) also write every image with the led circled. Slows down processing and reprocesses
+        images that are cached.
+      --view (optional) only regenerate the image with the led circled for one led and angle. Ex: --view 72 270
     """
     parser = argparse.ArgumentParser()
     parser.add_argument('-s', '--start-index', type=int, default=0, help='The index of the first LED to use.')
@@ -67,10 +416,32 @@ def main():
                         help='The relative folder for input files')
     parser.add_argument('-o', '--output-folder', type=str, default="./s2",
                         help='The relative folder for output files')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                        help='The number of processes used to process images.')
+    parser.add_argument('-d', '--detector', type=str, default="full", choices=list(DETECTORS.keys()),
+                        help='"full" blurs the full image, "coarse" finds the led on a downscaled image and refines '
+                             'it, "background" subtracts the unlit scene for each angle and then works like "coarse".')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Reprocess every image without reading or updating the cached detections.')
+    parser.add_argument('--cache-folder', type=str,
+                        help='Where cached detections are kept. Defaults to the cache folder in the output folder.')
+    parser.add_argument('--save-images', action='store_true',
+                        help='Write a copy of every image with the led circled. Cached detections are not reused.')
+    parser.add_argument('--view', type=int, nargs=2, metavar=('LED_ID', 'ANGLE'),
+                        help='Only write the image with the led circled for the given led and angle.')
     args = parser.parse_args()
 
     input_folder = c.get_image_processing_folder(args)
 
+    if args.view:
+        led_id, angle = args.view
+        debug_folder = os.path.join(args.output_folder, "debug")
+        coord2d = view_image(input_folder, debug_folder, led_id, angle, detector=args.detector)
+        if coord2d:
+            print(coord2d.to_json())
+            print(f"Image written to {os.path.abspath(os.path.join(debug_folder, processed_file_name(led_id, angle)))}")
+        return
+
     # Create the output folder
     out_folder = os.path.join(args.output_folder, datetime.now().strftime("%Y%m%d_%H%M"))
     if not os.path.exists(out_folder):
@@ -79,44 +450,55 @@ def main():
 
     out_file = os.path.join(out_folder, "processed_images.csv")
 
-    batch_starttime = time.perf_counter()
-    image_count = 0
+    jobs = find_jobs(input_folder, out_folder, args.start_index, args.end_index, detector=args.detector,
+                     save_images=args.save_images)
+
+    backgrounds = {}
+    if args.detector == "background":
+        print("Building background images...")
+        backgrounds = build_backgrounds(input_folder, out_folder, jobs)
+
+    # Look up every image in the cache. Only new or changed images need processing.
+    cache = DetectionCache(args.cache_folder or os.path.join(args.output_folder, "cache"),
+                           detector_params(args.detector))
+    keys = {} if args.no_cache else hash_jobs(jobs, cache.params, backgrounds, workers=args.jobs)
+    detections = {}
+    if args.save_images and not args.no_cache:
+        # Cached detections have no image to circle the led on.
+        print("Ignoring cached detections so every image is saved with the led circled.")
+    if not args.no_cache and not args.save_images:
+        for job in jobs:
+            cached = cache.get(keys[(job.led_id, job.angle)])
+            if cached is not None:
+                detections[(job.led_id, job.angle)] = Coord2d(job.led_id, job.angle, **cached)
+
+    pending = [job for job in jobs if (job.led_id, job.angle) not in detections]
+    print(f"Processing {len(pending)} images with {args.jobs} processes. "
+          f"{len(jobs) - len(pending)} images were already processed.")
+
+    progress = Progress(len(pending))
     try:
-        with open(out_file, 'w') as f:
-            for i in range(args.start_index, args.end_index):
-                for angle in [0, 45, 90, 135, 180, 225, 270, 315]:
-                    # Initialize some trackers
-                    img_starttime = time.perf_counter()
-
-                    # Check the input file
-                    base_file_name = f"led{i:03}_angle{angle:03}"
-                    input_file_name = os.path.join(input_folder, f"{base_file_name}.jpg")
-                    if not os.path.exists(input_file_name):
-                        print(f"Skipping {input_file_name}. File not found.")
-                        continue
-                    print(f"Processing {input_file_name}")
-                    image_count = image_count + 1
-
-                    # Find and mark the brightest spot
-                    loc, maxVal, processed_image = detect_light_location(input_file_name)
-                    cv2.circle(processed_image, loc, RADIUS, (255, 0, 0), 2)
-
-                    # Update the csv and save the image.
-                    coord2d = Coord2d(i, angle, loc[0], loc[1], maxVal)
-                    f.write(coord2d.to_json() + "\n")
-                    save_image(processed_image, out_folder, f"{base_file_name}_processed.jpg")
-
-                    # Print the timing information.
-                    img_endtime = time.perf_counter()
-                    print(f"Image {image_count} processed in {img_endtime - img_starttime:.2f}s")
-        print("Image processing complete\n\n")
+        for results in process_jobs(make_batches(pending, backgrounds), workers=args.jobs):
+            for coord2d in results:
+                if not args.no_cache:
+                    cache.put(keys[(coord2d.led_id, coord2d.angle)], coord2d.x, coord2d.y, coord2d.b, coord2d.c)
+                detections[(coord2d.led_id, coord2d.angle)] = coord2d
+            progress.update(len(results))
+        print("\nImage processing complete\n\n")
     except KeyboardInterrupt:
-        print("\nTidying up...\n\n")
+        print("\nTidying up... Rerun to resume from the last processed image.\n\n")
+    finally:
+        cache.close()
+
+        # Written in job order so the csv is the same no matter how many processes are used.
+        with open(out_file, 'w') as f:
+            for job in jobs:
+                if (job.led_id, job.angle) in detections:
+                    f.write(detections[(job.led_id, job.angle)].to_json() + "\n")
 
-    batch_endtime = time.perf_counter()
     c.write_continue_file(images_folder=input_folder, twod_coordinates_file=out_file)
     print(f"Results written to {os.path.abspath(out_folder)}")
-    print(f"Took {batch_endtime - batch_starttime:.2f}s to process {image_count} images.")
+    print(f"Took {progress.elapsed():.2f}s to process {progress.count} images.")
 
 
 # Main program logic follows:
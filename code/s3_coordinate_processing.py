@@ -3,22 +3,30 @@ import csv
 import os
 import sys
 
-from utils.animation import write_coordinates, normalize_coordinates, normalize_to_center
-from utils.visualize import draw, draw_distance_distribution
-from utils.coords import Coord3d, Coord2d
+from utils.animation import write_coordinates, normalize_coordinates, normalize_to_center, rotate_points, CENTER_OFFSET
+from utils.coords import Coord3d
+from utils import calibration
 from utils import continuation as cont
+from utils.shots import ANGLES, parse_data_file, shot_weights, stack_shots
 
 from datetime import datetime
-from statistics import mean
 
 import numpy as np
-from scipy.spatial.transform import Rotation as Rot
+from scipy.interpolate import make_lsq_spline
 
 # The percentile [0 / 100] to keep 'nearby' leds. (eg. 70 = LEDs with peers farther away than 70% of other leds will be
 # assumed invalid).
 THRESHOLD = 70
-IMAGE_HEIGHT = 1920
 IMAGE_WIDTH = 1080
+# Shots further than this from the least squares fit [px] are down weighted.
+HUBER_PX = 10
+ROBUST_ITERATIONS = 5
+# The number of reliable leds per piece of the spline along the strand. More leds per piece smooths out more noise.
+SPLINE_KNOT_STEP = 4
+# Gaps with more missing leds than this are flagged as untrusted.
+MAX_SPLINE_GAP = 10
+# Gaps where the spline needs this many times more wire than the leds have between them are flagged as untrusted.
+SPACING_TOLERANCE = 1.5
 
 with_z_move = {}
 without_z_move = {}
@@ -29,22 +37,43 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('-i', '--input-file', type=str, help='The file to read in.')
     parser.add_argument('-o', '--output-folder', default="./s3", type=str, help='The file to output.')
+    parser.add_argument('-l', '--least-squares', action='store_true',
+                        help='Fit each led to all of its shots instead of one shot from each pair of opposite angles.')
+    parser.add_argument('-c', '--camera', type=str,
+                        help='The camera file from `python3 -m utils.calibration`. Fits each led with perspective '
+                             'instead of treating the images as orthographic. Implies -l.')
+    parser.add_argument('-p', '--plots', choices=['show', 'save', 'none'], default='show',
+                        help='Show the diagnostic plots, save them next to the output or skip them.')
+    parser.add_argument('-s', '--spline', action='store_true',
+                        help='Fill missing leds from a smoothing spline along the strand instead of straight lines.')
     args = parser.parse_args()
 
     input_file = cont.get_twod_coordinates_file(args)
+    output_file_name = os.path.join(args.output_folder, f'{datetime.now().strftime("%Y%m%d_%H%M")}.csv')
 
     # Reads in coordinates and processes them such that the top back left pixel is 0,0,0.
     coordinates = {}
-    shots = parse_data_file(input_file)
-    missing = process_90_degrees(coordinates, shots)
-    fixed_45 = process_45_degrees(coordinates, missing, shots)
-
-    invalidate_outliers(coordinates)
-
-    fixed_neighbor = fix_with_neighbors(coordinates, missing)
+    shots = stack_shots(parse_data_file(input_file))
+    led_count = int(shots.led_ids.max()) + 1 if len(shots.led_ids) else 0
+    residuals = None
+    if args.least_squares or args.camera:
+        camera = calibration.load_camera(args.camera) if args.camera else None
+        missing, residuals = process_least_squares(coordinates, shots, camera)
+        fixed_45 = {}
+    else:
+        missing = process_90_degrees(coordinates, shots)
+        fixed_45 = process_45_degrees(coordinates, missing, shots)
+
+    dists = invalidate_outliers(coordinates, led_count)
+
+    untrusted = {}
+    if args.spline:
+        fixed_neighbor, untrusted = fix_with_spline(coordinates, missing, led_count)
+    else:
+        fixed_neighbor = fix_with_neighbors(coordinates, missing, led_count)
 
     # Log if there is some coordinate that we are missing.
-    for led_id in range(0, 500):
+    for led_id in range(0, led_count):
         if led_id not in coordinates:
             print(f"No Value for {led_id}")
 
@@ -52,15 +81,30 @@ def main():
     normalize_coordinates(coordinates)
     normalize_coordinates(fixed_45)
     normalize_coordinates(fixed_neighbor)
+    normalize_coordinates(untrusted)
 
     # Write the output to file
-    output_file_name = os.path.join(args.output_folder, f'{datetime.now().strftime("%Y%m%d_%H%M")}.csv')
     write_coordinates(output_file_name, coordinates)
+    if residuals:
+        write_residuals(os.path.splitext(output_file_name)[0] + "_residuals.csv", residuals)
 
     cont.write_continue_file(twod_coordinates_file=input_file, threed_coordinates_file=output_file_name)
 
+    if args.plots == 'none':
+        return
+
+    # Only load matplotlib when plotting. Saved plots don't need a display.
+    if args.plots == 'save':
+        import matplotlib
+        matplotlib.use("Agg")
+    from utils.visualize import draw, draw_distance_distribution
+
+    output_base = os.path.splitext(output_file_name)[0]
+    save = args.plots == 'save'
     try:
-        draw(list(coordinates.values()), [fixed_45, fixed_neighbor], limit=[0, 500], with_labels=False)
+        draw_distance_distribution(dists, THRESHOLD, file_name=f"{output_base}_distances.png" if save else None)
+        draw(list(coordinates.values()), [fixed_45, fixed_neighbor, untrusted], limit=[0, led_count], with_labels=False,
+             file_name=f"{output_base}_tree.png" if save else None)
 
     except KeyboardInterrupt:
         pass
@@ -71,56 +115,36 @@ def avg(a, b, offset=2):
     return int(a + diff // offset)
 
 
-def mean_z(shots):
-    """Returns the average z of the given shots. """
-    return mean(filter(lambda y: y != 0, map(lambda x: x.y, shots)))
-
-
-def middle_z(shots):
-    """Returns the z coordinate by finding the image where the led is nearest the center of the picture."""
-    return min(shots, key=lambda s: abs(s.x - 540)).y
-
-
-def extract_z(shots):
-    """This is an attempt to get the z value and minor lensing / perspective based on where the camera was."""
-    s = shots[0]
-
-    # 1 means far from the center vertically
-    z_diff = ((500 - s.y) / (IMAGE_HEIGHT // 2))
-    # print(f"z_diff {z_diff}")
-
-    # 1 means far from the center horizontally
-    midpoint_offset = abs(s.x - (IMAGE_WIDTH // 2))
-    x_diff = (midpoint_offset - 250) / 300
-    # print(f"x_diff {x_diff}")
-
-    net_offset = z_diff * x_diff
-    z_shift = -50
+def middle_z(xy, present):
+    """Returns the z coordinate of every led by finding the image where the led is nearest the center of the picture."""
+    offsets = np.where(present, np.abs(xy[..., 0] - 540), np.inf)
+    best = offsets.argmin(axis=1)
+    return xy[np.arange(len(xy)), best, 1]
 
-    shift = int(z_shift * net_offset)
 
-    # print(f"Shift [{s.x},{s.y}] by {shift}")
+def invalidate_outliers(coordinates, led_count):
+    """Deletes leds that are far from both of their neighbors. Returns the distances between neighboring leds."""
+    prev_ids, next_ids = reliable_neighbor_ids(coordinates, led_count)
 
-    return s.y + shift
-
-
-
-def invalidate_outliers(coordinates):
     # Generate two normal distributions
     dists = []
-    for i in range(0, 500):
+    for i in range(0, led_count):
         if reliable_coordinate(i, coordinates):
             a = coordinates[i]
 
-            b_id = get_next_neighbor_id(coordinates, i)
-            if b_id < 500:
+            b_id = next_ids[i]
+            if b_id < led_count:
                 b = coordinates[b_id]
                 dists.append(a.distance(b))
 
+    if not dists:
+        print("Too few reliable leds were detected to find outliers. Check the detections from s2. Exiting.")
+        sys.exit(1)
+
     percentile = np.percentile(dists, THRESHOLD)
 
     marked_for_deletion = []
-    for i in range(0, 500):
+    for i in range(0, led_count):
         if not reliable_coordinate(i, coordinates):
             if i in coordinates:
                 marked_for_deletion.append(i)
@@ -128,11 +152,11 @@ def invalidate_outliers(coordinates):
 
         curr = coordinates[i]
 
-        pi, ni = get_neighbor_ids(coordinates, i)
+        pi, ni = prev_ids[i], next_ids[i]
 
         if pi < 0:
             pi = i
-        if ni >= 500:
+        if ni >= led_count:
             ni = i
 
         prev_c = coordinates[pi]
@@ -149,23 +173,27 @@ def invalidate_outliers(coordinates):
     for m in marked_for_deletion:
         del coordinates[m]
 
-    draw_distance_distribution(dists, THRESHOLD)
+    return dists
 
 
-def fix_with_neighbors(coordinates, missing):
+def fix_with_neighbors(coordinates, missing, led_count):
     """
     Fix coordinates for all leds that don't have a good x/y/z using linear interpolation
     from the nearest neighbors on each side.
     """
     fixed_neighbor = {}
-    for led_id in range(0, 500):
+    # Leds are fixed in order so the previous neighbor may be one that was just fixed.
+    _, next_ids = reliable_neighbor_ids(coordinates, led_count)
+    prev_id = -1
+    for led_id in range(0, led_count):
         # Skip ones that aren't marked as missing and we have good coordinates for them.
         if led_id not in missing and reliable_coordinate(led_id, coordinates):
+            prev_id = led_id
             continue
 
-        prev_id, next_id = get_neighbor_ids(coordinates, led_id)
+        next_id = next_ids[led_id]
 
-        if prev_id in range(0, 500) and next_id in range(0, 500):
+        if prev_id in range(0, led_count) and next_id in range(0, led_count):
             prev_coord = coordinates[prev_id]
             next_coord = coordinates[next_id]
             offset = next_id - prev_id
@@ -178,138 +206,247 @@ def fix_with_neighbors(coordinates, missing):
             fixed_neighbor[led_id] = coord
             coordinates[led_id] = coord
 
+        if reliable_coordinate(led_id, coordinates):
+            prev_id = led_id
+
     print(f"Fixed neighbors: {len(fixed_neighbor)}")
     return fixed_neighbor
 
 
+def fix_with_spline(coordinates, missing, led_count):
+    """
+    Fix coordinates for all leds that don't have a good x/y/z using a smoothing spline through the reliable leds,
+    parameterized by led id. Every gap is evaluated in one call.
+
+    Gaps that are long or where the spline would stretch the wire further than the leds on each side allow are
+    filled but flagged as untrusted. Returns the map of fixed leds and the map of those that are untrusted.
+    """
+    reliable_ids = np.array([led_id for led_id in range(0, led_count)
+                             if led_id not in missing and reliable_coordinate(led_id, coordinates)], dtype=int)
+    if len(reliable_ids) < 2 * SPLINE_KNOT_STEP:
+        print("Too few reliable leds for a spline. Falling back to straight lines.")
+        return fix_with_neighbors(coordinates, missing, led_count), {}
+
+    points = np.array([coordinates[led_id][1:] for led_id in reliable_ids.tolist()], dtype=float)
+
+    # Only gaps with reliable leds on both sides are filled.
+    gap_ids = np.setdiff1d(np.arange(reliable_ids[0], reliable_ids[-1]), reliable_ids)
+    if not len(gap_ids):
+        print("Fixed neighbors: 0")
+        return {}, {}
+
+    # A least squares cubic spline with a knot every few reliable leds.
+    knots = np.concatenate([[reliable_ids[0]] * 4, reliable_ids[SPLINE_KNOT_STEP:-SPLINE_KNOT_STEP:SPLINE_KNOT_STEP],
+                            [reliable_ids[-1]] * 4])
+    spline = make_lsq_spline(reliable_ids, points, knots, k=3)
+    strand_ids = np.arange(reliable_ids[0], reliable_ids[-1] + 1)
+    strand = spline(strand_ids)
+    fixed = strand[gap_ids - strand_ids[0]]
+
+    # The distance between neighboring leds on the strand and how much wire the spline uses up to each led.
+    spacing = np.median(np.linalg.norm(np.diff(points, axis=0), axis=1) / np.diff(reliable_ids))
+    wire = np.concatenate([[0], np.cumsum(np.linalg.norm(np.diff(strand, axis=0), axis=1))])
+
+    # Each gap is the run of missing leds between two reliable ones.
+    after = np.searchsorted(reliable_ids, gap_ids)
+    prev_ids, next_ids = reliable_ids[after - 1], reliable_ids[after]
+    lengths = wire[next_ids - strand_ids[0]] - wire[prev_ids - strand_ids[0]]
+    too_long = (next_ids - prev_ids - 1) > MAX_SPLINE_GAP
+    stretched = lengths > (next_ids - prev_ids) * spacing * SPACING_TOLERANCE
+
+    fixed_neighbor = {}
+    untrusted = {}
+    for led_id, point, flagged in zip(gap_ids.tolist(), fixed.tolist(), (too_long | stretched).tolist()):
+        coord = Coord3d(led_id, *point)
+        fixed_neighbor[led_id] = coord
+        coordinates[led_id] = coord
+        if flagged:
+            untrusted[led_id] = coord
+
+    print(f"Fixed neighbors: {len(fixed_neighbor)}")
+    if untrusted:
+        print(f"{len(untrusted)} fixed leds are in gaps too long to trust:")
+        print(sorted(untrusted))
+    return fixed_neighbor, untrusted
+
+
 def process_45_degrees(coordinates, missing, shots):
     """
-    Go through the list of missing leds. Look at 45/135/225/315 angles and try to fill in the coordinates
-    If we cannot get both x and y from this, add it to the map of missing_45 leds.
+    Go through the set of missing leds. Look at 45/135/225/315 angles and try to fill in the coordinates
+    If we cannot get both x and y from this, the led stays missing.
     """
-    missing_45 = {}
-    fixed_45 = {}
-    for k, v in missing.items():
-        led_id = k
-        filtered_list = v
-        stored_point = coordinates[led_id]
-
-        # Extract the coordinates
-        z = middle_z(shots[k])
-
-        ys = list(filter(lambda s: s.angle in [135, 315], filtered_list))
-        y = (ys[0].x if ys[0].angle == 315 else IMAGE_WIDTH - ys[0].x) if ys else 0
-        xs = list(filter(lambda s: s.angle in [45, 225], filtered_list))
-        x = (xs[0].x if xs[0].angle == 45 else IMAGE_WIDTH - xs[0].x) if xs else 0
-
-        coord = rotate(Coord3d(led_id, x, y, z), -40)
-
-        # If we aren't sure on x or y, keep it set to 0.
-        if x == 0:
-            coord = Coord3d(coord.led_id, 0, coord.y, coord.z)
-        elif y == 0:
-            coord = Coord3d(coord.led_id, coord.x, 0, coord.z)
-
-        if stored_point.x != 0:
-            coord = Coord3d(coord.led_id, stored_point.x, coord.y, coord.z)
-        if stored_point.y != 0:
-            coord = Coord3d(coord.led_id, coord.x, stored_point.y, coord.z)
-
-        if x == 0 or y == 0:
-            missing_45[led_id] = filtered_list
-        else:
-            fixed_45[led_id] = coord
+    rows = np.flatnonzero(np.isin(shots.led_ids, list(missing)))
+    led_ids = shots.led_ids[rows]
+    xy, valid = shots.xy[rows], shots.valid[rows]
+
+    z = middle_z(xy, shots.present[rows])
+    y = view_axis(xy, valid, 135, 315)
+    x = view_axis(xy, valid, 45, 225)
+
+    # Rotate all the leds at once to match the angle the images were taken. Truncated like the 0/90 degree values.
+    points = rotate_points(np.stack([x, y, z], axis=1) + CENTER_OFFSET, -40) - CENTER_OFFSET
+    points = np.trunc(points)
+
+    # If we aren't sure on x or y, keep it set to 0.
+    points[x == 0, 0] = 0
+    points[(x != 0) & (y == 0), 1] = 0
 
+    # Keep any x / y that was found from the 0/90 degree images.
+    stored = np.array([[coordinates[led_id].x, coordinates[led_id].y] for led_id in led_ids.tolist()]).reshape(-1, 2)
+    points[:, :2] = np.where(stored != 0, stored, points[:, :2])
+
+    fixed = (x != 0) & (y != 0)
+    fixed_45 = {}
+    for led_id, point, is_fixed in zip(led_ids.tolist(), points.tolist(), fixed.tolist()):
+        coord = Coord3d(led_id, *point)
         coordinates[led_id] = coord
+        if is_fixed:
+            fixed_45[led_id] = coord
 
     print(f"Fixed 45 degree: {len(fixed_45)}")
-    for led_id, coord in fixed_45.items():
-        # print(f"F45 - {x.led_id:03}")
-        if led_id in missing:
-            del missing[led_id]
-    print(f"Missing after 45 degree: {len(missing_45)}")
+    missing.difference_update(fixed_45)
+    print(f"Missing after 45 degree: {len(missing)}")
     return fixed_45
 
 
 def process_90_degrees(coordinates, shots):
     """
     Go through the normal 0/90/180/270 angles and try to fill in the coordinates
-    If we cannot get both x and y from this, add it to the map of missing leds.
+    If we cannot get both x and y from this, add it to the set of missing leds.
     """
-    missing = {}
-    for k in shots.keys():
-        led_id = k
-
-        filtered_list = list(filter(lambda s: s.x != 0 and s.y != 0, shots[led_id]))
-
-        z = middle_z(shots[k])
-
-        ys = list(filter(lambda s: s.angle in [90, 270], filtered_list))
-        y = (ys[0].x if ys[0].angle == 270 else IMAGE_WIDTH - ys[0].x) if ys else 0
+    z = middle_z(shots.xy, shots.present)
+    y = view_axis(shots.xy, shots.valid, 90, 270)
+    x = view_axis(shots.xy, shots.valid, 0, 180)
 
-        xs = list(filter(lambda s: s.angle in [0, 180], filtered_list))
-        x = (xs[0].x if xs[0].angle == 0 else IMAGE_WIDTH - xs[0].x) if xs else 0
+    for led_id, point in zip(shots.led_ids.tolist(), np.stack([x, y, z], axis=1).tolist()):
+        coordinates[led_id] = Coord3d(led_id, *point)
 
-        if x == 0 or y == 0:
-            missing[led_id] = filtered_list
-
-        coordinates[led_id] = Coord3d(led_id, x, y, z)
+    missing = set(shots.led_ids[(x == 0) | (y == 0)].tolist())
     print(f"Missing after 0 degree: {len(missing)}")
     return missing
 
 
-def parse_data_file(file_name):
-    """Parses a CSV of format 'id###,angle###-x####-y#### into a list of Coordinate objects."""
-    # Check that the input file exists.
-    if not os.path.exists(f"{file_name}"):
-        print(f"Input csv file `{file_name}` not found. Exiting.")
-        sys.exit()
-
-    with open(file_name, 'r') as input_file:
-        lines = input_file.readlines()
-        lines = [line.rstrip() for line in lines]
+def process_least_squares(coordinates, shots, camera=None):
+    """
+    Fits the x/y/z of every led to all of its valid shots at once instead of one shot per axis. With a calibrated
+    camera, the shots are treated as rays from the camera instead of orthographic projections. Returns the set of
+    leds that couldn't be solved and a map of led_id to its residual (see `triangulate`).
+    """
+    if camera is None:
+        points, residuals, solved = triangulate(shots)
+    else:
+        points, residuals, solved = calibration.triangulate(shots.xy, shot_weights(shots), ANGLES, camera)
+        points[solved, :2] += IMAGE_WIDTH / 2
 
-    shots = {}
-    # Parse the lines and filter ones we don't want to consider.
-    for line in lines:
-        led = Coord2d.from_json(line)
+    for led_id, point in zip(shots.led_ids.tolist(), points.tolist()):
+        coordinates[led_id] = Coord3d(led_id, *point)
 
-        # If we weren't able to resolve the light, drop this element.
-        if (not led.x and not led.y) or led.b < 50:
-            continue
+    missing = set(shots.led_ids[~solved].tolist())
+    print(f"Missing after least squares: {len(missing)}")
+    if solved.any():
+        print(f"Residuals [px]: median {np.median(residuals[solved]):.1f} | "
+              f"95th percentile {np.percentile(residuals[solved], 95):.1f} | max {residuals[solved].max():.1f}")
+    return missing, dict(zip(shots.led_ids.tolist(), residuals.tolist()))
 
-        shots.setdefault(led.led_id, []).append(led)
-    return shots
 
+def triangulate(shots, iterations=ROBUST_ITERATIONS):
+    """
+    Finds the point that best explains every valid shot of each led, for all leds at once.
 
-def get_neighbor_ids(coordinates, led_id):
-    return get_prev_neighbor_id(coordinates, led_id), get_next_neighbor_id(coordinates, led_id)
+    Each image sees the tree from the side so the image x is the led's position across the view and the image y is
+    its height. For an image taken at angle a, the image x is `W/2 + (x - W/2) cos(a) - (y - W/2) sin(a)` in the same
+    pixel coordinates `process_90_degrees` uses. The x / y that minimize the error over all the images are solved as
+    a weighted linear least squares problem and the height is the weighted mean of the image y's.
 
+    Shots start weighted by their brightness. Shots that don't agree with the fit (a reflection, another led) are
+    then down weighted (Huber) and the fit is repeated.
 
-def get_prev_neighbor_id(coordinates, led_id):
-    prev_offset = 1
-    while led_id - prev_offset >= 0:
-        if reliable_coordinate(led_id - prev_offset, coordinates):
-            break
-        prev_offset += 1
-    return led_id - prev_offset
+    Returns the (N, 3) points ordered like `shots.led_ids`, the (N,) weighted rms distance [px] from each shot to the
+    fit and an (N,) mask of the leds that could be solved. Leds need shots from two views that aren't opposite each
+    other. Unsolved leds have x / y set to 0.
+    """
+    angles = np.radians(ANGLES)
+    # (angles, 2) How x / y move the image x in each view
+    directions = np.stack([np.cos(angles), -np.sin(angles)], axis=1)
+
+    u = np.where(shots.valid, shots.xy[..., 0] - IMAGE_WIDTH / 2, 0)
+    v = np.where(shots.valid, shots.xy[..., 1], 0)
+    prior = shot_weights(shots)
+
+    weights = prior
+    for _ in range(iterations + 1):
+        # Weighted normal equations for every led: (N, 2, 2) @ (N, 2) = (N, 2)
+        m = np.einsum('na,ai,aj->nij', weights, directions, directions)
+        r = np.einsum('na,ai,na->ni', weights, directions, u)
+        det = m[:, 0, 0] * m[:, 1, 1] - m[:, 0, 1] * m[:, 1, 0]
+        solved = det > 1e-6 * np.maximum(weights.sum(axis=1), 1) ** 2
+        m[~solved] = np.eye(2)
+        xy = np.linalg.solve(m, r[..., np.newaxis])[..., 0]
+        xy[~solved] = 0
+
+        total = np.maximum(weights.sum(axis=1), 1e-12)
+        z = (weights * v).sum(axis=1) / total
+
+        errors = np.hypot(u - xy @ directions.T, v - z[:, np.newaxis])
+        weights = prior * np.minimum(1, HUBER_PX / np.maximum(errors, 1e-12))
+
+    residuals = np.sqrt((weights * errors ** 2).sum(axis=1) / np.maximum(weights.sum(axis=1), 1e-12))
+    points = np.column_stack([xy + IMAGE_WIDTH / 2, z])
+    points[~solved, :2] = 0
+    return points, residuals, solved
+
+
+def view_axis(xy, valid, angle, opposite_angle):
+    """
+    Returns the position along one axis for every led from the image at `angle`, or the mirrored position from the
+    image at `opposite_angle` if there is no valid shot at `angle`. 0 if neither has one. The image x at 0, 45, 270
+    and 315 degrees runs along the axis and at the opposite angles it runs against it.
+    """
+    direct_angles = [0, 45, 270, 315]
+    values = np.zeros(len(xy))
+    # The lower angle is preferred, so fill in the other one first.
+    for a in sorted([angle, opposite_angle], reverse=True):
+        col = ANGLES.index(a)
+        x = xy[:, col, 0] if a in direct_angles else IMAGE_WIDTH - xy[:, col, 0]
+        values = np.where(valid[:, col], x, values)
+    return values
+
+
+def write_residuals(file_name, residuals):
+    """Writes the least squares residual [px] of every led as led_id,residual."""
+    with open(file_name, 'w') as output_file:
+        csvwriter = csv.writer(output_file)
+        for led_id in sorted(residuals.keys()):
+            csvwriter.writerow([led_id, round(residuals[led_id], 2)])
+    print(f"Residuals written to {os.path.abspath(file_name)}")
+
+
+def reliable_neighbor_ids(coordinates, led_count):
+    """
+    Returns two lists with the id of the nearest led with reliable coordinates before and after every led. Leds
+    without a reliable led before them get -1 and those without one after them get `led_count`.
+    """
+    prev_ids = [-1] * led_count
+    prev_id = -1
+    for led_id in range(0, led_count):
+        prev_ids[led_id] = prev_id
+        if reliable_coordinate(led_id, coordinates):
+            prev_id = led_id
 
+    next_ids = [led_count] * led_count
+    next_id = led_count
+    for led_id in reversed(range(0, led_count)):
+        next_ids[led_id] = next_id
+        if reliable_coordinate(led_id, coordinates):
+            next_id = led_id
 
-def get_next_neighbor_id(coordinates, led_id):
-    next_offset = 1
-    while led_id + next_offset <= 499:
-        if reliable_coordinate(led_id + next_offset, coordinates):
-            break
-        next_offset += 1
-    return led_id + next_offset
+    return prev_ids, next_ids
 
 
 def rotate(coord, angle) -> Coord3d:
-    r = Rot.from_rotvec(angle * np.array([0, 0, 1]), degrees=True)
-
     # Rotate the coordinates 45 degrees to match the angle the images were taken.
     v = normalize_to_center([coord.x, coord.y, coord.z])
-    v = r.apply(v).tolist()
+    v = rotate_points([v], angle)[0].tolist()
     v = denormalize_from_center(v)
     return Coord3d(coord.led_id, int(v[0]), int(v[1]), int(v[2]))
 
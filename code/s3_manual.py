@@ -15,11 +15,11 @@ import pygame
 import pygame_menu
 from pygame.font import Font
 
-from utils.animation import read_coordinates, write_coordinates, rotate
+from utils.animation import read_coordinates, write_coordinates, rotate_coordinates
 
 # The relative file containing the tree coordinates.
 from utils.colors import encode_rgb
-from utils.coords import Coord3d
+from utils.coords import Coord3d, CoordinateStore
 
 frame_width = 800
 frame_height = 800
@@ -33,7 +33,7 @@ fps = 20
 menu_theme = pygame_menu.themes.THEME_DARK
 
 surface: pygame.Surface
-coords: dict[int, Coord3d]
+coords: CoordinateStore
 text_font: Font
 coordinates_modified = False
 do_program = True
@@ -89,12 +89,8 @@ def translate(menu: Menu) -> None:
     menu.disable()
     print("Adjust Z")
 
-    min_x = min(map(lambda c: c.x, coords.values()))
-    max_x = max(map(lambda c: c.x, coords.values()))
-    min_y = min(map(lambda c: c.y, coords.values()))
-    max_y = max(map(lambda c: c.y, coords.values()))
-    min_z = min(map(lambda c: c.z, coords.values()))
-    max_z = max(map(lambda c: c.z, coords.values()))
+    min_x, min_y, min_z = coords.min()
+    max_x, max_y, max_z = coords.max()
 
     x_scaling = (max_x - min_x) / view_width
     x_offset = abs(int(min_x / x_scaling)) + padding
@@ -186,11 +182,11 @@ def translate(menu: Menu) -> None:
                     draw = True
 
         if any_pressed(KEYBOARD_DOWN, CONTROLLER_DOWN):
-            to_down_pressed[mode](coords[selected_led_id])
+            coords[selected_led_id] = to_down_pressed[mode](coords[selected_led_id])
             coordinates_modified = True
             draw = True
         elif any_pressed(KEYBOARD_UP, CONTROLLER_UP):
-            to_up_pressed[mode](coords[selected_led_id])
+            coords[selected_led_id] = to_up_pressed[mode](coords[selected_led_id])
             coordinates_modified = True
             draw = True
 
@@ -353,8 +349,8 @@ def rotate_screen(menu: Menu):
 
     global coordinates_modified, coords
 
-    min_z = min(map(lambda c: c.z, coords.values()))
-    max_z = max(map(lambda c: c.z, coords.values()))
+    _, _, min_z = coords.min()
+    _, _, max_z = coords.max()
     z_scaling = (max_z - min_z) / view_height
     z_offset = padding
 
@@ -366,8 +362,8 @@ def rotate_screen(menu: Menu):
     rotate_angle = 1
 
     while True:
-        min_x = min(map(lambda c: c.x, coords.values()))
-        max_x = max(map(lambda c: c.x, coords.values()))
+        min_x = coords.min()[0]
+        max_x = coords.max()[0]
         x_scaling = (max_x - min_x) / view_width
         x_offset = frame_width / 2
 
@@ -395,12 +391,12 @@ def rotate_screen(menu: Menu):
                     draw = True
 
         if any_pressed(KEYBOARD_DOWN, CONTROLLER_DOWN):
-            coords = {k: rotate(v, rotate_angle) for k, v in coords.items()}
+            coords = rotate_coordinates(coords, rotate_angle)
 
             coordinates_modified = True
             draw = True
         elif any_pressed(KEYBOARD_UP, CONTROLLER_UP):
-            coords = {k: rotate(v, -rotate_angle) for k, v in coords.items()}
+            coords = rotate_coordinates(coords, -rotate_angle)
 
             coordinates_modified = True
             draw = True
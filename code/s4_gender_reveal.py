@@ -17,7 +17,7 @@ def main():
     strip = LightStripLogger(args.output_file)
 
     coordinates = read_coordinates(args.input_file)
-    max_z = max(coordinates.values(), key=lambda c: c.z).z
+    max_z = coordinates.max()[2]
 
     band_width = 300
     animation_frames = 150
@@ -33,10 +33,9 @@ def main():
         offset = percent * band_width * 2
         return coord.with_z(coord.z + offset)
 
-    def rotate_by_height(fn, coord):
-        # Make 2 rotates up the tree
-        ratio = 1.5 * 360 * coord.z / max_z  # % through the turn
-        return rotate(coord, ratio)
+    def rotate_by_height(fn, points):
+        # Make 2 rotates up the tree. Use with `rotate_location`.
+        return 1.5 * 360 * points[:, 2] / max_z  # % through the turn
 
     def h_bands(fn, coord, color):
         # TODO: Generalize this to num bands and colors
@@ -1,12 +1,21 @@
 import argparse
+import os
 
 import PIL
-from PIL import Image
+import cv2
+import numpy as np
+from PIL import Image, ImageSequence
 from utils.animation import *
 from utils.colors import *
+from utils.projection import ImageProjection, PLANAR, PROJECTIONS
+from utils.spatial import CoordinateIndex
+from utils.video_decode import read_frames
 from utils.visualize import animate_tree
 from utils import continuation as cont
 
+# Files with these extensions are read as videos with cv2 instead of as animated images.
+VIDEO_EXTENSIONS = [".mp4", ".avi", ".mov", ".mkv", ".webm"]
+
 
 # Define functions which animate LEDs in various ways.
 def fill(strip, color=LED_OFF):
@@ -25,8 +34,10 @@ def fill_by_height(strip, coordinates, axis="z", width=300):
     max_brightness = 255
     green_adjust = .5
 
+    # Made once instead of every frame.
+    leds = list(coordinates.items())
     for i in range(width * 2, 0, -speed):
-        for led_id, coord in coordinates.items():
+        for led_id, coord in leds:
             # Distance from the given coordinate
             if axis == "x":
                 d = coord.x
@@ -55,33 +66,33 @@ def test_bars(strip, coordinates, axis="z", size = 100):
 
     if axis == 'x' or axis == 'y':
         r = range(0, IMAGE_WIDTH // size)
+    else:
+        axis = 'z'
 
+    index = CoordinateIndex(coordinates)
+    lit = []
     for i in r:
-        for led_id, coord in coordinates.items():
-            # Distance from the given coordinate
-            if axis == "x":
-                d = coord[0]
-            elif axis == "y":
-                d = coord[1]
-            else:
-                d = coord[2]
-
-            left = i * size
-            center = (i + 1) * size
-            right = (i + 2) * size
-
-            if left <= d <= center:
-                strip.setPixelColor(led_id, Color(0, 255, 0))
-            elif center <= d <= right:
-                strip.setPixelColor(led_id, Color(0, 0, 255))
-            else:
-                strip.setPixelColor(led_id, LED_OFF)
+        # Only the LEDs lit by the previous bars need to be turned off.
+        for led_id in lit:
+            strip.setPixelColor(led_id, LED_OFF)
+
+        left = i * size
+        center = (i + 1) * size
+        right = (i + 2) * size
+
+        blue = index.slab(axis, center, right).tolist()
+        green = index.slab(axis, left, center).tolist()
+        for led_id in blue:
+            strip.setPixelColor(led_id, Color(0, 0, 255))
+        for led_id in green:
+            strip.setPixelColor(led_id, Color(0, 255, 0))
+        lit = [*blue, *green]
         strip.show()
 
         input(f"Wait for {i}")
 
 
-def test_image(strip, coordinates):
+def test_image(strip, coordinates, projection=PLANAR):
     # img = Image.open("img/test.png").convert('RGB')
 
     img = Image.open("s4/snowflake.png").convert('RGB')
@@ -89,40 +100,41 @@ def test_image(strip, coordinates):
 
     # img = Image.open("img/WE.png").convert('RGB')
 
-    for led_id, coord in coordinates.items():
+    image_projection = ImageProjection(coordinates, projection)
+    colors = image_projection.sample(np.asarray(img))
+    for led_id, h in zip(image_projection.led_ids.tolist(), colors.tolist()):
         # Get color for that LED
-        h = img.getpixel((coord[0], coord[2]))
         strip.setPixelColor(led_id, Color(h[1], h[0], h[2]))
 
-        # if _is_on(coord[0], coord[2] + 100, img, size=10):
-        #     strip.setPixelColor(led_id, PINK)
-        # else:
-        #     strip.setPixelColor(led_id, LED_OFF)
+    # Light the LEDs where most of the area around them is lit.
+    # on = image_projection.coverage(np.asarray(img)[..., 0] > 1, radius=10) > .5
+    # for led_id, is_on in zip(image_projection.led_ids.tolist(), on.tolist()):
+    #     strip.setPixelColor(led_id, PINK if is_on else LED_OFF)
 
     strip.show()
 
 
-def _is_on(x, y, img, size=20):
+def test_animated_image(strip, coordinates, file_name, projection=PLANAR, radius=0):
+    """Plays each frame of an animated image (eg: a gif) or a video (eg: an mp4) on the tree."""
+    image_projection = ImageProjection(coordinates, projection)
+    led_ids = image_projection.led_ids.tolist()
 
-    total = 0
-    on_count = 0
-    for i in range(x - size, x + size):
-        if 0 > i or i > IMAGE_WIDTH:
-            print(f"OOR x: {i}")
-            continue
+    for frame in animated_image_frames(file_name):
+        colors = image_projection.sample(frame, radius=radius)
+        for led_id, h in zip(led_ids, colors.tolist()):
+            strip.setPixelColor(led_id, Color(h[1], h[0], h[2]))
+        strip.show()
 
-        for j in range(y - size, y + size):
-            if 0 > j or j > IMAGE_HEIGHT:
-                print(f"OOR y: {j}")
-                continue
 
-            total += 1
-            h = img.getpixel((i, j))
-            # print(f"{x} {y} {i} {j} {h}")
-            if h[0] > 1:
-                on_count += 1
+def animated_image_frames(file_name):
+    """Yields the RGB frames of an animated image or a video as arrays."""
+    if os.path.splitext(file_name)[1].lower() in VIDEO_EXTENSIONS:
+        for frame in read_frames(file_name):
+            yield cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        return
 
-    return on_count > (total // 2)
+    for frame in ImageSequence.Iterator(Image.open(file_name)):
+        yield np.asarray(frame.convert('RGB'))
 
 
 def main():
@@ -131,8 +143,13 @@ def main():
     parser.add_argument('-i', '--input-file', type=str, help='The file to read in.')
     parser.add_argument('-o', '--output-file', type=str, help='The file to write out.')
     parser.add_argument('-s', '--test-image', action='store_true', help='Whether to show the test image')
+    parser.add_argument('-g', '--animated-image', type=str,
+                        help='An animated image (eg: gif) or a video (eg: mp4) to play on the tree')
+    parser.add_argument('-p', '--projection', type=str, default=PLANAR, choices=PROJECTIONS,
+                        help='How images are projected onto the tree')
     parser.add_argument('-t', '--test-bars', action='store_true', help='Whether to show test bars')
     parser.add_argument('-x', '--axis', type=str, help='The axis to run the animation around')
+    parser.add_argument('--no-preview', action='store_true', help='Write the animation without previewing it.')
     args = parser.parse_args()
 
     input_file = cont.get_tree_coordinates(args.input_file)
@@ -145,7 +162,9 @@ def main():
     try:
         print("Creating animation")
         if args.test_image:
-            test_image(light_strip, coordinates)
+            test_image(light_strip, coordinates, projection=args.projection)
+        elif args.animated_image:
+            test_animated_image(light_strip, coordinates, args.animated_image, projection=args.projection)
         elif args.test_bars:
             test_bars(light_strip, coordinates, axis=args.axis, size=args.test_bars)
         else:
@@ -153,7 +172,8 @@ def main():
 
         light_strip.write_to_file()
 
-        animate_tree(input_file, light_strip.output_filename)
+        if not args.no_preview:
+            animate_tree(input_file, light_strip.output_filename)
 
     except KeyboardInterrupt:
         # Catch interrupt
@@ -12,7 +12,7 @@ from pygame.surface import Surface
 
 from utils.animation import read_coordinates
 from utils.colors import encode_rgb
-from utils.coords import Coord3d
+from utils.coords import Coord3d, CoordinateStore
 from network import lights_pb2
 from network import lights_pb2_grpc
 
@@ -73,14 +73,18 @@ class Tree:
         return cls._TREE
 
     def __init__(self, remote_address):
-        self.coords: dict[int, Coord3d] = read_coordinates(tree_coordinates_file)
+        self.coords: CoordinateStore = read_coordinates(tree_coordinates_file)
 
-        self.min_x = min(map(lambda c: c.x, self.coords.values()))
+        min_x, _, min_z = self.coords.min().tolist()
+        _, _, max_z = self.coords.max().tolist()
+        z = self.coords.points[:, 2]
 
-        self.min_z = min(map(lambda c: c.z, self.coords.values()))
-        self.min_z_coord = min(self.coords.values(), key=lambda c: c.z)
-        self.max_z = max(map(lambda c: c.z, self.coords.values()))
-        self.max_z_coord = max(self.coords.values(), key=lambda c: c.z).with_x(0).with_z(self.max_z + 200)
+        self.min_x = min_x
+
+        self.min_z = min_z
+        self.min_z_coord = self.coords[self.coords.led_ids[z.argmin()].item()]
+        self.max_z = max_z
+        self.max_z_coord = self.coords[self.coords.led_ids[z.argmax()].item()].with_x(0).with_z(self.max_z + 200)
 
         self.lane_assignments: dict[int, Bucket] = self.get_lane_assignments(self.coords)
         self._notes: list[Note] = []
@@ -106,24 +110,21 @@ class Tree:
             distance = abs(closest.ratio - b.ratio) * 100
             return sigmoid(light_up_ratio - abs(distance))
 
-        def get_x(c) -> int:
-            # Shift the tree to the right to be visible
-            return ((abs(self.min_x) + c.x) * scale) + shift_x
-
-        def get_y(c) -> int:
-            # In 3d, z is the vertical axis with 0 starting at the bottom.
-            return ((self.max_z - c.z) * scale) + shift_y
-
+        # Works on the led ids / points directly so no Coord3d is made per led per frame.
         pix = {}
-        for id_num, coord in self.coords.items():
+        rows = {}
+        for row, id_num in enumerate(self.coords.led_ids.tolist()):
             bucket = self.lane_assignments[id_num]
             light_bright = get_brightness(bucket)
 
             if light_bright > pix_brightness_threshold:
-                pix_color = self.get_pix_color(coord, brightness=light_bright)
+                pix_color = self.get_pix_color(id_num, brightness=light_bright)
                 pix[id_num] = pix_color
             elif bucket.ratio >= target_ratio:
                 pix[id_num] = COLORS_PRESSED[bucket.lane_num] if bucket.lane_num in self._fret_pressed else GREY
+            else:
+                continue
+            rows[id_num] = row
 
         if self._channel:
             # Send a request containing only the illuminated pixels
@@ -134,17 +135,21 @@ class Tree:
 
             self._stub.SetLights(request)
 
-        # Render locally
+        # Render locally. Shift the tree to the right to be visible. In 3d, z is the vertical axis with 0 starting at
+        # the bottom.
+        points = self.coords.points
+        screen_x = ((abs(self.min_x) + points[:, 0]) * scale) + shift_x
+        screen_y = ((self.max_z - points[:, 2]) * scale) + shift_y
         for led_id, color in pix.items():
-            coord = self.coords[led_id]
-            pygame.draw.circle(screen, color, (get_x(coord), get_y(coord)), 2)
+            row = rows[led_id]
+            pygame.draw.circle(screen, color, (screen_x[row].item(), screen_y[row].item()), 2)
 
         self._notes.clear()
         self._fret_pressed.clear()
 
-    def get_pix_color(self, c: Coord3d, brightness: float = 1.0) -> pygame.Color:
-        """Picks the lane color of the coordinate based on where it falls on the tree."""
-        return pygame.Color(COLORS[self.lane_assignments[c.led_id][0]]).lerp(pygame.Color(0, 0, 0), 1 - brightness)
+    def get_pix_color(self, led_id: int, brightness: float = 1.0) -> pygame.Color:
+        """Picks the lane color of the led based on where it falls on the tree."""
+        return pygame.Color(COLORS[self.lane_assignments[led_id][0]]).lerp(pygame.Color(0, 0, 0), 1 - brightness)
 
     def is_left_of(self, a: Coord3d, b: Coord3d, c: Coord3d) -> bool:
         """
@@ -157,14 +162,14 @@ class Tree:
         """Returns the position as a ratio of 'completeness' where the bottom of the tree is 1."""
         return (self.max_z - z) / self.max_z
 
-    def get_lane_assignments(self, coords: dict[int, Coord3d]) -> dict[int, Bucket]:
+    def get_lane_assignments(self, coords: CoordinateStore) -> dict[int, Bucket]:
         """
         Get lane -> list[list[int]]
         """
 
         # Sort all the coordinates horizontally
-        min_x = min(map(lambda c: c.x, coords.values()))
-        max_x = max(map(lambda c: c.x, coords.values()))
+        min_x = coords.min()[0].item()
+        max_x = coords.max()[0].item()
         range_x = max_x - min_x
         delta_x = range_x / 5
 
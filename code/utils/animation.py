@@ -1,21 +1,24 @@
 import copy
 import csv
+import functools
 import logging
 import math
 import os
-import re
 import time
-from scipy.spatial.transform import Rotation as Rot
 import numpy as np
 
 from utils.colors import LED_OFF
-from utils.coords import Coord3d
+from utils.coordinate_cache import load_points
+from utils.coords import Coord3d, CoordinateStore
 
 logger = logging.getLogger(__name__)
 
 IMAGE_HEIGHT = 1920
 IMAGE_WIDTH = 1080
 
+# The shift applied by `normalize_to_center` to move the origin from the image corner to the tree stem.
+CENTER_OFFSET = np.array([-(IMAGE_WIDTH / 2) + 5, -(IMAGE_WIDTH / 2) - 5, 0])
+
 
 def percent_off_true(x, y):
     """
@@ -32,14 +35,52 @@ def rotate(coord, angle):
     """
     Rotates the given coordinate the specified angle amount.
     """
-    angle = int(angle)
-    r = Rot.from_rotvec(angle * np.array([0, 0, 1]), degrees=True)
-
-    # Rotate the coordinates 45 degrees to match the angle the images were taken.
-    v = r.apply([coord.x, coord.y, coord.z]).tolist()
+    v = rotate_points([[coord.x, coord.y, coord.z]], int(angle))[0]
     return Coord3d(coord.led_id, int(v[0]), int(v[1]), int(v[2]))
 
 
+def rotate_coordinates(coordinates, angle):
+    """
+    Rotates every coordinate in the map the specified angle amount about the z axis. Returns a new CoordinateStore.
+    """
+    store = CoordinateStore.from_dict(coordinates)
+    return CoordinateStore(store.led_ids.copy(), rotate_points(store.points, int(angle)).astype(int))
+
+
+@functools.lru_cache(maxsize=1024)
+def z_rotation_matrix(angle):
+    """
+    Returns the 3x3 matrix rotating a point the given angle (in degrees) about the z axis. Matrices are cached since
+    animations tend to reuse the same handful of angles every frame.
+    """
+    r = math.radians(angle)
+    c = math.cos(r)
+    s = math.sin(r)
+    m = np.array([[c, -s, 0], [s, c, 0], [0, 0, 1]])
+    m.setflags(write=False)
+    return m
+
+
+def rotate_points(points, angles):
+    """
+    Rotates an (N, 3) array of points about the z axis. `angles` (in degrees) is either a single angle applied to every
+    point or an array of N angles, one per point. Returns an (N, 3) float array.
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 3)
+
+    if np.ndim(angles) == 0:
+        return points @ z_rotation_matrix(float(angles)).T
+
+    r = np.radians(np.asarray(angles, dtype=float))
+    c = np.cos(r)
+    s = np.sin(r)
+    rotated = np.empty_like(points)
+    rotated[:, 0] = c * points[:, 0] - s * points[:, 1]
+    rotated[:, 1] = s * points[:, 0] + c * points[:, 1]
+    rotated[:, 2] = points[:, 2]
+    return rotated
+
+
 def is_back_of_tree(coord, threshold=-100):
     """Input is a list or tuple of size 3. Returns True if this pixel is primarily on the back of the tree."""
     return coord.y < threshold
@@ -84,40 +125,26 @@ class LightStripLogger:
                 csvwriter.writerow(data)
 
 
-def read_coordinates(file_name) -> dict[int, Coord3d]:
+def read_coordinates(file_name) -> CoordinateStore:
     """
     Reads coordinates from the given file name. Coordinates must be a CSV file where the ith row contains RGB values
-    for the ith element.
+    for the ith element. The parsed file is cached next to the input (see `coordinate_cache`).
     """
-    rgb_pattern = re.compile("^([-+]?[01].[0-9]+),([-+]?[01].[0-9]+),([+]?[0-9]+.[0-9]+)$")
-
     logging.info("Reading coordinate file %s", file_name)
-    with open(file_name, 'r') as input_file:
-        lines = [line.rstrip() for line in input_file.readlines()]
+    points = load_points(file_name)
 
     # Scales the coordinates to be in [-500, 500] for x/y and [0, n * 500] for z.
-    def scale(val):
-        return int(val * 500)
-
-    logging.info("Processing %s coordinates...", len(lines))
-    coordinates = {}
-    for led_id, xyz in enumerate(lines):
-        if not rgb_pattern.match(xyz):
-            logging.exception(f"Invalid coordinate input for line {led_id} |{xyz}|."
-                              f" Expected to be comma separated rgb values with x/y in [-1,1] and z > 0. ")
-        x, y, z = list(map(float, xyz.split(",")))
-        coordinates[led_id] = Coord3d(led_id, scale(x), scale(y), scale(z))
+    coordinates = CoordinateStore(range(len(points)), (points * 500).astype(int))
 
+    min_xyz, max_xyz = coordinates.min(), coordinates.max()
     logging.info(
-        "Processing complete. Coordinates in [%s, %s] [%s, %s] [%s, %s]",
-        min(map(lambda c: c.x, coordinates.values())), max(map(lambda c: c.x, coordinates.values())),
-        min(map(lambda c: c.y, coordinates.values())), max(map(lambda c: c.y, coordinates.values())),
-        min(map(lambda c: c.z, coordinates.values())), max(map(lambda c: c.z, coordinates.values())))
+        "Read %s coordinates. Coordinates in [%s, %s] [%s, %s] [%s, %s]", len(coordinates),
+        min_xyz[0], max_xyz[0], min_xyz[1], max_xyz[1], min_xyz[2], max_xyz[2])
 
     return coordinates
 
 
-def write_coordinates(file_name: str, coords: dict[int, Coord3d], normalize=False, center_invert=True) -> None:
+def write_coordinates(file_name: str, coords, normalize=False, center_invert=True) -> None:
     if normalize:
         normalize_coordinates(coords, center_invert=center_invert)
 
@@ -129,54 +156,63 @@ def write_coordinates(file_name: str, coords: dict[int, Coord3d], normalize=Fals
     print(f"Results written to {os.path.abspath(file_name)}")
 
 def normalize_coordinates(coordinates, center_invert=True, with_log=True):
-    """Normalizes the coordinates into GIFT format."""
-    centered = [normalize_coord_to_center(x) for x in coordinates.values()] if center_invert else list(coordinates.values())
-    min_x = min(map(lambda c: c.x, centered))
-    max_x = max(map(lambda c: c.x, centered))
-    min_y = min(map(lambda c: c.y, centered))
-    max_y = max(map(lambda c: c.y, centered))
-    min_z = min(map(lambda c: c.z, centered))
-    max_z = max(map(lambda c: c.z, centered))
+    """
+    Normalizes the coordinates into GIFT format. Accepts either a CoordinateStore or a map of led_id to Coord3d and
+    updates it in place.
+    """
+    if not len(coordinates):
+        return
+
+    store = CoordinateStore.from_dict(coordinates)
+    normalized = normalize_points(store.points, center_invert=center_invert, with_log=with_log)
+
+    # Update all the values in the coordinate map.
+    if store is coordinates:
+        store.points = normalized
+    else:
+        for led_id, v in zip(store.led_ids.tolist(), normalized.tolist()):
+            coordinates[led_id] = Coord3d(led_id, *v)
+
+
+def normalize_points(points, center_invert=True, with_log=True):
+    """Normalizes an (N, 3) array of points into GIFT format. Returns a new float array."""
+    centered = np.asarray(points, dtype=float)
+    if center_invert:
+        centered = centered + CENTER_OFFSET
+
+    min_x, min_y, min_z = centered.min(axis=0)
+    max_x, max_y, max_z = centered.max(axis=0)
 
     if with_log:
         print(f"Normalizing to X in [{min_x}, {max_x}] / Y in [{min_y}, {max_y}] / Z in [{min_z}, {max_z}]")
 
     # Invert the z axis and normalize so that the lowest pixel is 0.
-    inverted = [Coord3d(x.led_id, x.x, x.y, max_z - x.z) for x in centered] if center_invert else [Coord3d(x.led_id, x.x, x.y, x.z) for x in centered]
-
-    min_z = min(map(lambda c: c.z, inverted))
-    max_z = max(map(lambda c: c.z, inverted))
+    inverted = centered.copy()
+    if center_invert:
+        inverted[:, 2] = max_z - centered[:, 2]
 
     if with_log:
-        print(f"Normalized to Z in [{min_z}, {max_z}]")
+        print(f"Normalized to Z in [{inverted[:, 2].min()}, {inverted[:, 2].max()}]")
 
     # Scale so that everything is relative to the largest x/y offset
-
     scaling_factor = max(map(abs, [min_x, max_x, min_y, max_y]))
-    scaled_coordinate = [Coord3d(c.led_id, c.x / scaling_factor, c.y / scaling_factor, c.z / scaling_factor) for c in
-                         inverted]
-
-    min_x = min(map(lambda c: c.x, scaled_coordinate))
-    max_x = max(map(lambda c: c.x, scaled_coordinate))
-    min_y = min(map(lambda c: c.y, scaled_coordinate))
-    max_y = max(map(lambda c: c.y, scaled_coordinate))
-    min_z = min(map(lambda c: c.z, scaled_coordinate))
-    max_z = max(map(lambda c: c.z, scaled_coordinate))
+    scaled = inverted / scaling_factor
 
     if with_log:
+        min_x, min_y, min_z = scaled.min(axis=0)
+        max_x, max_y, max_z = scaled.max(axis=0)
         print(
             f"Scaled by {scaling_factor} to X in [{min_x}, {max_x}] / Y in [{min_y}, {max_y}] / Z "
             f"in [{min_z}, {max_z}]")
 
-    # Update all the values in the coordinate map.
-    for updated_coordinate in scaled_coordinate:
-        coordinates[updated_coordinate.led_id] = updated_coordinate
+    return scaled
+
 
 def normalize_to_center(v):
     """
     Shifts the origin from the corner to the center. This is needed to rotate the coordinate plane about the center.
     """
-    return [v[0] - (IMAGE_WIDTH / 2) + 5, v[1] - (IMAGE_WIDTH / 2) - 5, v[2]]
+    return [v[0] + CENTER_OFFSET[0], v[1] + CENTER_OFFSET[1], v[2]]
 
 
 def normalize_coord_to_center(coord):
@@ -1,4 +1,8 @@
+import numpy as np
+
+from code.utils.animation import CoordinateStore, rotate_points
 from code.utils.colors import LED_OFF
+from code.utils.coords import Coord3d
 
 class Animator:
     def __init__(self, strip):
@@ -10,6 +14,14 @@ class Animator:
         self.transforms.append(LocationTransform(transform))
         return self
 
+    def rotate_location(self, angles):
+        """
+        Rotates the leds about the z axis. `angles` is a function of (frame number, (N, 3) points) that returns the
+        angle (in degrees) of every led, or one angle for all of them. The leds are rotated together each frame.
+        """
+        self.transforms.append(RotationTransform(angles))
+        return self
+
     def transform_color(self, transform):
         self.transforms.append(ColorTransform(transform))
         return self
@@ -21,29 +33,75 @@ class Animator:
     def animate(self, coordinates):
         assert self.frames >= 0, "No frames are used for this animation. Call `until` with a frame count"
 
+        store = CoordinateStore.from_dict(coordinates)
+        led_ids = store.led_ids.tolist()
+        # The untransformed Coord3d objects are made once and shared by every frame.
+        coords = FrameCoordinates(led_ids, store.points).coords()
         for frame in range(0, self.frames):
-            for led_id, coord in coordinates.items():
-                color = LED_OFF
-                c = coord
-                for t in self.transforms:
-                    c, color = t.transform(frame, c, color)
+            leds = FrameCoordinates(led_ids, store.points, coords)
+            colors = [LED_OFF] * len(led_ids)
+            for t in self.transforms:
+                colors = t.transform(frame, leds, colors)
 
+            for led_id, color in zip(led_ids, colors):
                 self.strip.setPixelColor(led_id, color)
 
             self.strip.show()
 
 
+class FrameCoordinates:
+    def __init__(self, led_ids, points, coords=None):
+        """The led coordinates of one frame as they are moved by the transforms. Rotations work on the (N, 3) points
+        and the other transforms on Coord3d objects. Each form is only built when a transform asks for it.
+
+        Args:
+            led_ids (list): The led id of each row of the points.
+            points (np.ndarray): The (N, 3) coordinates before any transform.
+            coords (list, optional): The Coord3d of every led matching the points. Made from the points if not given.
+        """
+        self.led_ids = led_ids
+        self._points = points
+        self._coords = coords
+
+    def points(self):
+        if self._points is None:
+            self._points = np.array([[c.x, c.y, c.z] for c in self._coords])
+        return self._points
+
+    def coords(self):
+        if self._coords is None:
+            self._coords = [Coord3d(led_id, *p) for led_id, p in zip(self.led_ids, self._points.tolist())]
+        return self._coords
+
+    def set_points(self, points):
+        self._points, self._coords = points, None
+
+    def set_coords(self, coords):
+        self._points, self._coords = None, coords
+
+
 class ColorTransform:
     def __init__(self, t):
         self.t = t
 
-    def transform(self, frame_num, coord, color):
-        return coord, self.t(frame_num, coord, color)
+    def transform(self, frame_num, leds, colors):
+        return [self.t(frame_num, coord, color) for coord, color in zip(leds.coords(), colors)]
 
 
 class LocationTransform:
     def __init__(self, t):
         self.t = t
 
-    def transform(self, frame_num, coord, color):
-        return self.t(frame_num, coord), color
+    def transform(self, frame_num, leds, colors):
+        leds.set_coords([self.t(frame_num, coord) for coord in leds.coords()])
+        return colors
+
+
+class RotationTransform:
+    def __init__(self, angles):
+        self.angles = angles
+
+    def transform(self, frame_num, leds, colors):
+        points = leds.points()
+        leds.set_points(rotate_points(points, self.angles(frame_num, points)).astype(int))
+        return colors
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""Camera calibration for s3. Without it, s3 treats every image as if it was taken from infinitely far away so leds
+close to the camera come out too far from the trunk and leds behind the trunk too close to it.
+
+The focal length can be measured from photos of a printed checkerboard taken with the capture camera in the same
+orientation and resolution as the captures, or it can be fit to the led detections of the captures themselves:
+
+  python3 -m utils.calibration -c checkerboard_photos -i s2/<timestamp>/processed_images.csv
+  python3 s3_coordinate_processing.py -c s3/camera.json
+
+Coordinates are in s3's pixel coordinates centered on the tree's axis: x / y are the image pixels at the distance of
+the axis and z is the image row. The camera is assumed to point at the tree's axis from the side (the principal point
+is on the axis), so the camera is `focal` of these pixels away from the axis.
+"""
+import argparse
+import glob
+import json
+import os
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+from utils import continuation as cont
+from utils.shots import ANGLES, parse_data_file, shot_weights, stack_shots
+
+# The upright image size of the captures [px].
+IMAGE_WIDTH = 1080
+IMAGE_HEIGHT = 1920
+# The inner corners of the checkerboard (columns, rows).
+CHECKERBOARD = (9, 6)
+# The focal lengths [px] searched when fitting the camera to the captures.
+MIN_FOCAL = IMAGE_WIDTH / 4
+MAX_FOCAL = IMAGE_WIDTH * 100
+# Shots further than this from the fit [px] are down weighted.
+HUBER_PX = 10
+ROBUST_ITERATIONS = 5
+
+# `side` is +1 / -1 depending on which way the tree was turned between angles. `distortion` is the list of OpenCV
+# distortion coefficients (empty for none).
+CameraModel = namedtuple('CameraModel', 'focal cx cy side distortion')
+
+
+def default_camera():
+    """A camera centered on the image, so far away that it is practically the orthographic camera s3 assumes."""
+    return CameraModel(MAX_FOCAL, IMAGE_WIDTH / 2, IMAGE_HEIGHT / 2, 1, [])
+
+
+def load_camera(file_name):
+    with open(file_name, 'r') as f:
+        return CameraModel(**json.load(f))
+
+
+def save_camera(file_name, camera):
+    with open(file_name, 'w') as f:
+        json.dump(camera._asdict(), f, indent=2)
+    print(f"Camera written to {os.path.abspath(file_name)}")
+
+
+def from_checkerboard(image_files, pattern=CHECKERBOARD):
+    """Measures the focal length, principal point and lens distortion from photos of a checkerboard."""
+    cols, rows = pattern
+    board = np.zeros((cols * rows, 3), np.float32)
+    board[:, :2] = np.mgrid[0:cols, 0:rows].T.reshape(-1, 2)
+
+    object_points, image_points, size = [], [], None
+    for file_name in image_files:
+        gray = cv2.imread(file_name, cv2.IMREAD_GRAYSCALE)
+        found, corners = cv2.findChessboardCorners(gray, pattern)
+        if not found:
+            print(f"No checkerboard found in {file_name}")
+            continue
+        corners = cv2.cornerSubPix(gray, corners, (11, 11), (-1, -1),
+                                   (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, .001))
+        object_points.append(board)
+        image_points.append(corners)
+        size = gray.shape[::-1]
+
+    if not image_points:
+        raise ValueError("No checkerboard found in any of the images.")
+
+    rms, matrix, distortion, _, _ = cv2.calibrateCamera(object_points, image_points, size, None, None)
+    print(f"Calibrated from {len(image_points)} images with an error of {rms:.2f}px")
+    return CameraModel(float(matrix[0, 0] + matrix[1, 1]) / 2, float(matrix[0, 2]), float(matrix[1, 2]), 1,
+                       distortion.ravel().tolist())
+
+
+def undistort(xy, camera):
+    """Returns the (..., 2) pixel coordinates as they would be seen through a lens without distortion."""
+    if not any(camera.distortion):
+        return xy
+    matrix = np.array([[camera.focal, 0, camera.cx], [0, camera.focal, camera.cy], [0, 0, 1]])
+    points = cv2.undistortPoints(xy.reshape(-1, 1, 2).astype(np.float64), matrix, np.array(camera.distortion),
+                                 P=matrix)
+    return points.reshape(xy.shape)
+
+
+def _views(angles, camera):
+    """Returns the (angles, 3) right / down / forward directions and the (angles, 3) position of every camera."""
+    angles = np.radians(angles)
+    right = np.stack([np.cos(angles), -np.sin(angles), np.zeros(len(angles))], axis=1)
+    down = np.tile([0., 0., 1.], (len(angles), 1))
+    forward = camera.side * np.cross(right, down)
+    centers = np.array([0., 0., camera.cy]) - camera.focal * forward
+    return right, down, forward, centers
+
+
+def project(points, angles, camera):
+    """Returns the (N, angles, 2) pixel coordinates of the (N, 3) points in each view and their (N, angles) depth."""
+    right, down, forward, centers = _views(angles, camera)
+    offsets = points[:, np.newaxis, :] - centers
+    depth = np.einsum('nai,ai->na', offsets, forward)
+    scale = camera.focal / np.maximum(depth, 1e-9)
+    u = camera.cx + scale * np.einsum('nai,ai->na', offsets, right)
+    v = camera.cy + scale * np.einsum('nai,ai->na', offsets, down)
+    return np.stack([u, v], axis=-1), depth
+
+
+def triangulate(xy, weights, angles, camera, iterations=ROBUST_ITERATIONS):
+    """
+    Finds the point closest to the rays from each camera through the led's pixel in that image, for all leds at
+    once. Every led is a weighted least squares problem of its own, solved together as (N, 3, 3) systems.
+
+    The distance to each ray is scaled to pixels by the depth of the last fit and shots that don't agree with the fit
+    are down weighted (Huber) before the fit is repeated.
+
+    Args:
+        xy (np.array): The (N, angles, 2) pixel coordinate of every led in every image.
+        weights (np.array): The (N, angles) weight of every shot. 0 for shots that are missing.
+        angles (list): The angle [degrees] of every image.
+        camera (CameraModel): The camera the images were taken with.
+        iterations (int, optional): How many times the fit is repeated with robust weights.
+
+    Returns the (N, 3) points, the (N,) weighted rms reprojection error [px] and an (N,) mask of the leds that could
+    be solved. Leds need shots from two views.
+    """
+    right, down, forward, centers = _views(angles, camera)
+    xy = undistort(xy, camera)
+
+    # (N, angles, 3) unit direction of every ray
+    rays = ((xy[..., 0:1] - camera.cx) * right + (xy[..., 1:2] - camera.cy) * down) / camera.focal + forward
+    rays /= np.linalg.norm(rays, axis=-1, keepdims=True)
+    # (N, angles, 3, 3) projection onto the plane perpendicular to each ray
+    perpendicular = np.eye(3) - rays[..., :, np.newaxis] * rays[..., np.newaxis, :]
+
+    prior = np.asarray(weights, dtype=float)
+    robust = np.ones_like(prior)
+    pixel_scale = np.ones_like(prior)
+    for _ in range(iterations + 1):
+        w = prior * robust * pixel_scale
+        m = np.einsum('na,naij->nij', w, perpendicular)
+        r = np.einsum('na,naij,aj->ni', w, perpendicular, centers)
+        lowest = np.linalg.eigvalsh(m)[:, 0]
+        solved = lowest > 1e-4 * np.maximum(w.sum(axis=1), 1e-12)
+        m[~solved] = np.eye(3)
+        points = np.linalg.solve(m, r[..., np.newaxis])[..., 0]
+
+        projected, depth = project(points, angles, camera)
+        errors = np.linalg.norm(projected - xy, axis=-1)
+        robust = np.minimum(1, HUBER_PX / np.maximum(errors, 1e-12))
+        # A world unit away from the ray is focal / depth pixels in the image.
+        pixel_scale = np.where(depth > 0, (camera.focal / np.maximum(depth, 1e-9)) ** 2, 1)
+
+    w = prior * robust
+    residuals = np.sqrt((w * errors ** 2).sum(axis=1) / np.maximum(w.sum(axis=1), 1e-12))
+    points[~solved] = 0
+    return points, residuals, solved
+
+
+def fit_camera(xy, weights, angles, camera, fit_focal=True):
+    """
+    Returns the camera with the focal length (unless `fit_focal` is False) and side that best explain the detections,
+    i.e. with the lowest median reprojection error over all leds.
+    """
+    def error(focal, side):
+        candidate = camera._replace(focal=focal, side=side)
+        _, residuals, solved = triangulate(xy, weights, angles, candidate, iterations=1)
+        return np.median(residuals[solved]) if solved.any() else np.inf
+
+    focals = np.geomspace(MIN_FOCAL, MAX_FOCAL, 40) if fit_focal else [camera.focal]
+    _, focal, side = min((error(focal, side), focal, side) for focal in focals for side in (1, -1))
+
+    if fit_focal:
+        # Golden section search on log(focal) around the best focal length on the grid.
+        step = np.log(MAX_FOCAL / MIN_FOCAL) / (len(focals) - 1)
+        low = max(np.log(focal) - step, np.log(MIN_FOCAL))
+        high = min(np.log(focal) + step, np.log(MAX_FOCAL))
+        ratio = (np.sqrt(5) - 1) / 2
+        for _ in range(20):
+            a, b = high - ratio * (high - low), low + ratio * (high - low)
+            if error(np.exp(a), side) < error(np.exp(b), side):
+                high = b
+            else:
+                low = a
+        focal = float(np.clip(np.exp((low + high) / 2), MIN_FOCAL, MAX_FOCAL))
+        if np.isclose(focal, MIN_FOCAL, rtol=.01) or np.isclose(focal, MAX_FOCAL, rtol=.01):
+            print(f"The focal length fit hit the end of the search range ({focal:.0f}px) so it is only a bound. "
+                  f"Measure it from checkerboard photos (-c) instead.")
+
+    return camera._replace(focal=float(focal), side=side)
+
+
+def main():
+    """
+    Writes the camera model used by `s3_coordinate_processing.py -c`.
+    Flags:
+      -i the s2 csv of the captures. The side (and focal length without -c) are fit to its detections.
+      -c (optional) a folder of checkerboard photos to measure the focal length and lens distortion from.
+      -o (optional) the file to write. Defaults to ./s3/camera.json
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--input-file', type=str, help='The s2 csv of led detections.')
+    parser.add_argument('-c', '--checkerboard', type=str, help='A folder of checkerboard photos.')
+    parser.add_argument('--pattern', type=int, nargs=2, default=CHECKERBOARD, metavar=('COLUMNS', 'ROWS'),
+                        help='The inner corners of the checkerboard.')
+    parser.add_argument('-o', '--output-file', type=str, default="./s3/camera.json", help='The file to write.')
+    args = parser.parse_args()
+
+    camera = default_camera()
+    if args.checkerboard:
+        image_files = sorted(glob.glob(os.path.join(args.checkerboard, "*.jpg")) +
+                             glob.glob(os.path.join(args.checkerboard, "*.png")))
+        camera = from_checkerboard(image_files, tuple(args.pattern))
+
+    shots = stack_shots(parse_data_file(cont.get_twod_coordinates_file(args)))
+    weights = shot_weights(shots)
+    camera = fit_camera(shots.xy, weights, ANGLES, camera, fit_focal=not args.checkerboard)
+
+    points, residuals, solved = triangulate(shots.xy, weights, ANGLES, camera)
+    height = np.ptp(points[solved, 2]) if solved.any() else 0
+    print(f"Focal length {camera.focal:.0f}px ({np.degrees(2 * np.arctan(IMAGE_WIDTH / 2 / camera.focal)):.0f} degree "
+          f"field of view) | side {camera.side:+d}")
+    if height:
+        print(f"The camera is {camera.focal / height:.1f} tree heights from the tree's axis.")
+    print(f"Residuals [px]: median {np.median(residuals[solved]):.1f} | "
+          f"95th percentile {np.percentile(residuals[solved], 95):.1f}")
+
+    out_folder = os.path.dirname(args.output_file)
+    if out_folder and not os.path.exists(out_folder):
+        os.makedirs(out_folder)
+    save_camera(args.output_file, camera)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+
+class ThreadedCamera:
+    def __init__(self, cam, rotate=None, writers=2):
+        """Reads a camera in a background thread so frames never go stale in the driver's buffer. Every frame is
+        stamped with the time it was requested from the camera so callers can ask for the first frame taken after the
+        leds changed. Images are rotated, encoded and written by a pool of threads so the caller never waits on disk.
+
+        Args:
+            cam: An opened cv2.VideoCapture or anything else with read() / get() / set() / release().
+            rotate (int, optional): A cv2.ROTATE_* code applied to images before they are saved.
+            writers (int, optional): The number of threads writing images. Defaults to 2.
+        """
+        self.cam = cam
+        self.rotate = rotate
+        self._condition = threading.Condition()
+        self._frame = None
+        self._timestamp = float("-inf")
+        self._running = True
+        self._writer = ThreadPoolExecutor(max_workers=writers)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while self._running:
+            requested = time.perf_counter()
+            s, img = self.cam.read()
+            if not s:
+                time.sleep(.01)
+                continue
+            with self._condition:
+                self._frame = img
+                self._timestamp = requested
+                self._condition.notify_all()
+
+    def frame_after(self, after=None, timeout=5):
+        """
+        Returns the (timestamp, image) of the first frame requested from the camera after `after` (a
+        time.perf_counter() value, defaults to now). If the caller is slow, a newer frame may be returned instead.
+        """
+        after = time.perf_counter() if after is None else after
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._timestamp > after, timeout):
+                raise TimeoutError(f"No frame from the camera in {timeout}s")
+            return self._timestamp, self._frame
+
+    def save(self, file_name, image):
+        """Rotates and writes the image in the background. Returns a future that completes once it is on disk."""
+        return self.submit(lambda upright: cv2.imwrite(file_name, upright), image)
+
+    def submit(self, write, image):
+        """Rotates the image and calls `write` with it in the background. Returns the future of the call."""
+        return self._writer.submit(lambda: write(self.orient(image)))
+
+    def orient(self, image):
+        """Returns the image rotated the way saved images are."""
+        return image if self.rotate is None else cv2.rotate(image, self.rotate)
+
+    def get(self, prop):
+        return self.cam.get(prop)
+
+    def set(self, prop, value):
+        return self.cam.set(prop, value)
+
+    def close(self):
+        """Stops reading, waits for every image to be written and releases the camera."""
+        self._running = False
+        self._thread.join()
+        self._writer.shutdown(wait=True)
+        self.cam.release()
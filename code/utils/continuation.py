@@ -3,6 +3,8 @@ import sys
 
 CONTINUE_FILE = "./utils/.continue.txt"
 UNSET = "-"
+# When set, the scripts don't write the continuation file. The pipeline passes each script its inputs directly.
+NO_CONTINUE_ENV = "LEDS_NO_CONTINUE"
 
 
 def get_image_processing_folder(args):
@@ -50,7 +52,10 @@ def get_tree_coordinates(input_file):
         sys.exit(1)
 
 def write_continue_file(images_folder="", twod_coordinates_file="", threed_coordinates_file=""):
-    """Writes the input / output to the continuation file."""
+    """Writes the input / output to the continuation file unless NO_CONTINUE_ENV is set."""
+    if os.environ.get(NO_CONTINUE_ENV):
+        return
+
     if os.path.isfile(CONTINUE_FILE):
         with open(CONTINUE_FILE, 'r') as file:
             data = file.read().rstrip().split(",")
@@ -0,0 +1,84 @@
+import hashlib
+import json
+import logging
+import os
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+CACHE_SUFFIX = ".cache.npy"
+CACHE_META_SUFFIX = ".cache.json"
+
+
+def load_points(file_name) -> np.ndarray:
+    """
+    Loads the raw x/y/z rows of a coordinate CSV as an (N, 3) float array. The parsed array is written to a sidecar
+    `.cache.npy` file keyed by the source's mtime and hash so later loads are a single memory map.
+    """
+    cache_file = file_name + CACHE_SUFFIX
+    meta_file = file_name + CACHE_META_SUFFIX
+
+    stat = os.stat(file_name)
+    meta = _read_meta(meta_file)
+    if meta and os.path.isfile(cache_file):
+        if meta.get("mtime_ns") == stat.st_mtime_ns and meta.get("size") == stat.st_size:
+            logger.debug("Loading cached coordinates from %s", cache_file)
+            return np.load(cache_file, mmap_mode='r')
+
+        # The file was touched. Only reparse if the contents actually changed.
+        digest = _hash_file(file_name)
+        if meta.get("sha1") == digest:
+            try:
+                _write_meta(meta_file, stat, digest)
+            except OSError:
+                pass
+            return np.load(cache_file, mmap_mode='r')
+    else:
+        digest = _hash_file(file_name)
+
+    points = parse_points(file_name)
+
+    try:
+        np.save(cache_file, points)
+        _write_meta(meta_file, stat, digest)
+    except OSError as e:
+        logger.warning("Unable to write coordinate cache %s: %s", cache_file, e)
+
+    return points
+
+
+def parse_points(file_name) -> np.ndarray:
+    """
+    Parses a coordinate CSV where the ith row holds the x/y/z of the ith led with x/y in [-1, 1] and z > 0.
+    """
+    points = np.loadtxt(file_name, delimiter=",", dtype=float, ndmin=2, encoding="utf-8-sig")
+    if points.shape[1] != 3:
+        raise ValueError(f"Expected 3 columns in {file_name} but found {points.shape[1]}")
+
+    invalid = np.flatnonzero((np.abs(points[:, :2]) > 1).any(axis=1) | (points[:, 2] < 0))
+    for led_id in invalid:
+        logger.error(f"Invalid coordinate input for line {led_id} |{points[led_id]}|."
+                     f" Expected to be comma separated rgb values with x/y in [-1,1] and z > 0. ")
+
+    return points
+
+
+def _hash_file(file_name):
+    with open(file_name, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def _read_meta(meta_file):
+    if not os.path.isfile(meta_file):
+        return None
+    try:
+        with open(meta_file, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_meta(meta_file, stat, digest):
+    with open(meta_file, 'w') as f:
+        json.dump({"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "sha1": digest}, f)
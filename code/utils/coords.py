@@ -1,8 +1,11 @@
 import dataclasses
 import json
 import math
+from collections.abc import MutableMapping
 from dataclasses import dataclass
 
+import numpy as np
+
 
 @dataclass
 class Coord3d:
@@ -48,6 +51,8 @@ class Coord2d:
     x: int
     y: int
     b: int
+    # How sure the detector is that (x, y) is the led and not another light [0, 1]. None if not measured.
+    c: float = None
 
     def to_json(self):
         return json.dumps(self, cls=EnhancedJSONEncoder)
@@ -57,6 +62,86 @@ class Coord2d:
         attrs_dict = json.loads(json_string)
         return Coord2d(**attrs_dict)
 
+
+class CoordinateStore(MutableMapping):
+    """
+    Container for the tree coordinates backed by a contiguous (N, 3) numpy array and a matching array of led ids.
+    Behaves like the dict[int, Coord3d] it replaces, but Coord3d objects are only created when a single led is
+    accessed. Bulk work (bounds, normalizing, rotating) should use `points` directly.
+    """
+
+    def __init__(self, led_ids, points):
+        self.led_ids = np.asarray(led_ids, dtype=int).reshape(-1)
+        self.points = np.asarray(points).reshape(-1, 3)
+        if len(self.led_ids) != len(self.points):
+            raise ValueError(f"Got {len(self.led_ids)} led ids for {len(self.points)} coordinates")
+
+        self._rows = {led_id: row for row, led_id in enumerate(self.led_ids.tolist())}
+
+    @classmethod
+    def from_dict(cls, coordinates):
+        """Builds a store from a map of led_id to Coord3d."""
+        if isinstance(coordinates, CoordinateStore):
+            return coordinates
+        points = [[c.x, c.y, c.z] for c in coordinates.values()]
+        return CoordinateStore(list(coordinates.keys()), points)
+
+    def to_dict(self) -> dict[int, Coord3d]:
+        return dict(self.items())
+
+    def min(self):
+        """Returns the [min_x, min_y, min_z] of the coordinates."""
+        return self.points.min(axis=0)
+
+    def max(self):
+        """Returns the [max_x, max_y, max_z] of the coordinates."""
+        return self.points.max(axis=0)
+
+    def __getitem__(self, led_id) -> Coord3d:
+        row = self._rows[led_id]
+        return Coord3d(led_id, *self.points[row].tolist())
+
+    def values(self) -> list[Coord3d]:
+        """Every coordinate, made in one pass over `points`. Loops that run every frame should use `points` instead."""
+        return [Coord3d(led_id, *p) for led_id, p in zip(self.led_ids.tolist(), self.points.tolist())]
+
+    def items(self) -> list[tuple[int, Coord3d]]:
+        return [(c.led_id, c) for c in self.values()]
+
+    def __setitem__(self, led_id, coord: Coord3d):
+        value = np.array([coord.x, coord.y, coord.z])
+
+        # Storing a float into an int backed store (eg: after normalizing) widens the whole array.
+        dtype = np.result_type(self.points, value)
+        if dtype != self.points.dtype:
+            self.points = self.points.astype(dtype)
+
+        if led_id in self._rows:
+            self.points[self._rows[led_id]] = value
+        else:
+            self._rows[led_id] = len(self.led_ids)
+            self.led_ids = np.append(self.led_ids, led_id)
+            self.points = np.vstack([self.points, value])
+
+    def __delitem__(self, led_id):
+        row = self._rows[led_id]
+        self.led_ids = np.delete(self.led_ids, row)
+        self.points = np.delete(self.points, row, axis=0)
+        self._rows = {i: r for r, i in enumerate(self.led_ids.tolist())}
+
+    def __contains__(self, led_id):
+        return led_id in self._rows
+
+    def __iter__(self):
+        return iter(self.led_ids.tolist())
+
+    def __len__(self):
+        return len(self.led_ids)
+
+    def __repr__(self):
+        return f"CoordinateStore({len(self)} coordinates)"
+
+
 class EnhancedJSONEncoder(json.JSONEncoder):
     def default(self, o):
         if dataclasses.is_dataclass(o):
@@ -0,0 +1,78 @@
+import hashlib
+import json
+import os
+
+
+class DetectionCache:
+    """
+    A content addressed store of led detections. Results are keyed by the hash of the image and the detector
+    parameters so reruns skip images that have already been processed with the same settings. Each result is
+    appended to `detections.jsonl` as soon as it is known so interrupted runs pick up where they left off.
+    """
+
+    def __init__(self, folder, params):
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+        self.file_name = os.path.join(folder, "detections.jsonl")
+        self.params = params
+        self._results = {}
+        self._file = None
+
+        if os.path.isfile(self.file_name):
+            with open(self.file_name, 'rb+') as f:
+                data = f.read()
+                # The last line may be partially written if a previous run was killed. Cut it off so new results
+                # aren't appended to it.
+                end = data.rfind(b"\n") + 1
+                if end < len(data):
+                    f.truncate(end)
+            for line in data[:end].decode().splitlines():
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                self._results[entry.pop("key")] = entry
+
+    def key(self, image, background_file_name=None, salt=""):
+        """Returns the cache key for the image with the current detector parameters. See `detection_key`."""
+        return detection_key(self.params, image, background_file_name, salt)
+
+    def get(self, key):
+        """Returns a dict of the cached x / y / b / c for the key or None."""
+        return self._results.get(key)
+
+    def put(self, key, x, y, b, c=None):
+        self._results[key] = {"x": x, "y": y, "b": b, "c": c}
+
+        if self._file is None:
+            self._file = open(self.file_name, 'a')
+        self._file.write(json.dumps({"key": key, **self._results[key]}) + "\n")
+        self._file.flush()
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def __len__(self):
+        return len(self._results)
+
+
+def detection_key(params, image, background_file_name=None, salt=""):
+    """
+    Returns the cache key for the image with the detector parameters. `image` is the image file name or the image
+    array itself. If a background image was subtracted, its content is part of the key as well. A plain function so
+    worker processes can hash images without a copy of the cache.
+    """
+    h = hashlib.sha1(json.dumps(params, sort_keys=True).encode())
+    h.update(salt.encode())
+    if isinstance(image, str):
+        with open(image, 'rb') as f:
+            h.update(f.read())
+    else:
+        h.update(image)
+    if background_file_name:
+        with open(background_file_name, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
@@ -0,0 +1,140 @@
+import os
+import struct
+import threading
+
+import cv2
+import numpy as np
+
+# File layout: a fixed size header followed by one record per frame. Each record is the led id followed by the
+# gray-scale pixels of the region of interest, so the whole file can be memory mapped as a numpy record array.
+MAGIC = b"LEDFRAME"
+VERSION = 1
+# magic, version, height, width, x, y, full height, full width
+HEADER = struct.Struct("<8sIIIIIII")
+HEADER_SIZE = 64
+
+# Pixels brighter than this in the lit image (after removing the dark image) are part of the tree.
+ROI_THRESHOLD = 40
+# The number of pixels kept around the tree.
+ROI_MARGIN = 50
+
+
+def archive_file_name(angle):
+    return f"frames_angle{angle:03}.frames"
+
+
+def find_roi(lit, dark, threshold=ROI_THRESHOLD, margin=ROI_MARGIN):
+    """
+    Returns the (x, y, width, height) of the part of the image with the tree in it given an image with every led lit
+    and one with every led off. Returns the whole image if no leds are found.
+    """
+    lit, dark = _gray(lit), _gray(dark)
+    height, width = lit.shape
+    mask = cv2.subtract(lit, dark) > threshold
+    rows = np.flatnonzero(mask.any(axis=1))
+    cols = np.flatnonzero(mask.any(axis=0))
+    if not len(rows):
+        return 0, 0, width, height
+
+    x0, x1 = max(cols[0] - margin, 0), min(cols[-1] + margin + 1, width)
+    y0, y1 = max(rows[0] - margin, 0), min(rows[-1] + margin + 1, height)
+    return int(x0), int(y0), int(x1 - x0), int(y1 - y0)
+
+
+def _gray(image):
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+
+
+def _record_dtype(height, width):
+    return np.dtype([("led_id", "<i4"), ("pixels", "u1", (height, width))])
+
+
+class FrameArchiveWriter:
+    def __init__(self, file_name, roi, full_shape):
+        """Appends gray-scale frames cropped to the region of interest to an archive. Frames for an existing archive
+        are appended so an interrupted capture can resume. They are cropped to the region the archive was started with
+        even if `roi` moved a little since. Safe to call from several threads.
+
+        Args:
+            file_name (str): The archive to write.
+            roi (tuple): The (x, y, width, height) of the region of the frames to keep. Only used for a new archive.
+            full_shape (tuple): The (height, width) of the uncropped frames.
+        """
+        self.file_name = file_name
+        self._lock = threading.Lock()
+
+        existing = _read_header(file_name) if os.path.isfile(file_name) else b""
+        if len(existing) == HEADER_SIZE:
+            magic, version, height, width, x, y, *old_shape = HEADER.unpack(existing[:HEADER.size])
+            if magic != MAGIC or version != VERSION or tuple(old_shape) != tuple(full_shape):
+                raise ValueError(f"{file_name} is not a version {VERSION} frame archive of {full_shape[1]}x"
+                                 f"{full_shape[0]} frames. Move it away to start a new capture.")
+            self.x, self.y, self.width, self.height = x, y, width, height
+            self._record_size = _record_dtype(self.height, self.width).itemsize
+
+            # Drop a partially written frame from a capture that was killed.
+            count = (os.path.getsize(file_name) - HEADER_SIZE) // self._record_size
+            self._file = open(file_name, 'r+b')
+            self._file.truncate(HEADER_SIZE + count * self._record_size)
+            self._file.seek(0, os.SEEK_END)
+        else:
+            self.x, self.y, self.width, self.height = roi
+            self._record_size = _record_dtype(self.height, self.width).itemsize
+            self._file = open(file_name, 'wb')
+            self._file.write(HEADER.pack(MAGIC, VERSION, self.height, self.width, self.x, self.y, *full_shape)
+                             .ljust(HEADER_SIZE, b"\0"))
+
+    def append(self, led_id, image):
+        """Crops and writes the frame. Color images are converted to gray-scale."""
+        crop = np.ascontiguousarray(_gray(image)[self.y:self.y + self.height, self.x:self.x + self.width])
+        if crop.shape != (self.height, self.width):
+            raise ValueError(f"Frame of shape {image.shape[:2]} is smaller than the region of interest.")
+
+        with self._lock:
+            self._file.write(struct.pack("<i", led_id))
+            self._file.write(crop.tobytes())
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def _read_header(file_name):
+    with open(file_name, 'rb') as f:
+        return f.read(HEADER_SIZE)
+
+
+class FrameArchive:
+    """
+    Reads an archive written by `FrameArchiveWriter`. Frames are memory mapped so only the pixels that are used are
+    read from disk. If a led was captured more than once, the last frame is used.
+    """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        magic, version, self.height, self.width, x, y, full_height, full_width = HEADER.unpack(
+            _read_header(file_name)[:HEADER.size])
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{file_name} is not a version {VERSION} frame archive.")
+        self.origin = (x, y)
+        self.full_shape = (full_height, full_width)
+
+        dtype = _record_dtype(self.height, self.width)
+        count = (os.path.getsize(file_name) - HEADER_SIZE) // dtype.itemsize
+        if count:
+            self._records = np.memmap(file_name, dtype=dtype, mode='r', offset=HEADER_SIZE, shape=(count,))
+        else:
+            self._records = np.zeros(0, dtype=dtype)
+
+        self._rows = {led_id: row for row, led_id in enumerate(self._records["led_id"].tolist())}
+        self.led_ids = sorted(self._rows)
+
+    def frame(self, led_id):
+        """Returns the (height, width) gray-scale frame of the led. The array is a read only view of the file."""
+        return self._records[self._rows[led_id]]["pixels"]
+
+    def __contains__(self, led_id):
+        return led_id in self._rows
+
+    def __len__(self):
+        return len(self._rows)
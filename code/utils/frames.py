@@ -0,0 +1,64 @@
+import mmap
+import os
+
+import numpy as np
+
+
+class FrameSource:
+    def __init__(self, path: str, header=False, step=1, start=0, end=None):
+        """Reads animation frames on demand. The file is memory mapped and only the line offsets are found up front so
+        even long animations open instantly. Frames are decoded as they are requested.
+
+        Args:
+            path (str): The path to the animation csv or a .npy array with one frame per row
+            header (bool, optional): Whether there is a header that should be ignored. Defaults to False.
+            step (int, optional): Only every step-th frame is kept. Defaults to 1.
+            start (int, optional): The first frame to keep. Defaults to 0.
+            end (int, optional): The frame to stop at (exclusive). Defaults to the end of the animation.
+        """
+        self._array = None
+        self._mmap = None
+
+        if path.endswith(".npy"):
+            array = np.load(path, mmap_mode="r")
+            self._array = array[1:] if header else array
+            self._rows = np.arange(len(self._array))[start:end:step]
+            return
+
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._mmap is None:
+            self._rows = np.empty(0, dtype=int)
+            return
+
+        # Find the start / end of every non-empty line
+        data = np.frombuffer(self._mmap, dtype=np.uint8)
+        ends = np.flatnonzero(data == ord("\n"))
+        if data[-1] != ord("\n"):
+            ends = np.append(ends, len(data))
+        starts = np.concatenate(([0], ends[:-1] + 1))
+        non_empty = ends > starts
+        starts, ends = starts[non_empty], ends[non_empty]
+        if header:
+            starts, ends = starts[1:], ends[1:]
+
+        self._starts = starts
+        self._ends = ends
+        self._rows = np.arange(len(starts))[start:end:step]
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __getitem__(self, idx):
+        row = self._rows[idx]
+        if self._array is not None:
+            return np.asarray(self._array[row], dtype=float)
+
+        line = self._mmap[self._starts[row]:self._ends[row]].replace(b"\xef\xbb\xbf", b"")
+        return np.array(line.split(b","), dtype=float)
+
+    def frame_number(self, idx):
+        """Returns the frame number in the full animation of the idx-th kept frame."""
+        return int(self._rows[idx])
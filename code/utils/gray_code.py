@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""Structured light capture. Instead of one image per led, each image lights the leds whose Gray coded id has one bit
+set, followed by the inverse image. Every led is found in the all leds image and its id is read back from whether it
+was brighter in the image or its inverse for each bit. 500 leds take 9 bits = 18 images per angle.
+
+Images captured by `s1_capture_images.py -g` are decoded into the same csv that s2 produces:
+
+Usage: python3 -m utils.gray_code -i tree_captures -o ./s2
+"""
+import argparse
+import os
+import sys
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+from utils import continuation as c
+from utils.coords import Coord2d
+
+ANGLES = [0, 45, 90, 135, 180, 225, 270, 315]
+# Pixels brighter than this after the background is removed are part of a led.
+BLOB_THRESHOLD = 40
+# Blobs with fewer pixels than this are noise.
+MIN_BLOB_AREA = 4
+# Radius must be odd for GaussianBlur
+RADIUS = 11
+
+
+def to_gray(values):
+    """Gray code of the values. Neighboring ids differ in only one bit."""
+    values = np.asarray(values)
+    return values ^ (values >> 1)
+
+
+def from_gray(codes):
+    codes = np.asarray(codes).copy()
+    shift = codes >> 1
+    while shift.any():
+        codes ^= shift
+        shift >>= 1
+    return codes
+
+
+def bit_count(led_count):
+    """The number of bits needed to give every led a unique code."""
+    return max(int(led_count - 1).bit_length(), 1)
+
+
+def pattern(led_ids, bit, inverse=False):
+    """Returns a boolean mask of which leds are lit in the image for the bit."""
+    lit = (to_gray(led_ids) >> bit) & 1 == 1
+    return ~lit if inverse else lit
+
+
+def pattern_file_name(bit, angle, inverse=False):
+    return f"gray{bit:02}{'i' if inverse else ''}_angle{angle:03}.jpg"
+
+
+def captured_bits(folder, angle):
+    """The number of bits that were captured at the angle, i.e. how many image / inverse pairs there are in a row."""
+    bits = 0
+    while all(os.path.isfile(os.path.join(folder, pattern_file_name(bits, angle, inverse)))
+              for inverse in [False, True]):
+        bits += 1
+    return bits
+
+
+def find_blobs(lit, dark):
+    """
+    Finds the leds in the image with every led lit. Returns the label image, the number of labels and the brightness
+    weighted (x, y) and peak brightness of every blob. Label 0 is the background.
+    """
+    diff = cv2.GaussianBlur(cv2.subtract(lit, dark), (RADIUS, RADIUS), 0)
+    _, mask = cv2.threshold(diff, BLOB_THRESHOLD, 255, cv2.THRESH_BINARY)
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+
+    # Small blobs become background.
+    small = np.flatnonzero(stats[:, cv2.CC_STAT_AREA] < MIN_BLOB_AREA)
+    labels[np.isin(labels, small)] = 0
+
+    flat = labels.ravel()
+    weights = diff.ravel().astype(np.float64)
+    rows, cols = np.indices(diff.shape)
+    total = np.bincount(flat, weights=weights, minlength=count)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        x = np.bincount(flat, weights=weights * cols.ravel(), minlength=count) / total
+        y = np.bincount(flat, weights=weights * rows.ravel(), minlength=count) / total
+
+    peak = np.zeros(count)
+    np.maximum.at(peak, flat, weights)
+    return labels, count, x, y, peak
+
+
+def decode_angle(folder, angle, led_count=None):
+    """
+    Decodes the pattern images for one angle. Returns the list of Coord2d, one per led that was found. The confidence
+    is how clearly the weakest bit was read: 1 when the led was dark in every off image, near 0 when the image and its
+    inverse were almost the same brightness (two leds in one blob, a reflection).
+
+    Without `led_count`, the number of bits is taken from the pattern images in the folder.
+    """
+    def read(file_name):
+        image = cv2.imread(os.path.join(folder, file_name), cv2.IMREAD_GRAYSCALE)
+        if image is None:
+            raise ValueError(f"Could not read {os.path.join(folder, file_name)}.")
+        return image
+
+    captured = captured_bits(folder, angle)
+    if led_count is None:
+        led_count = 1 << captured
+    elif bit_count(led_count) > captured:
+        raise ValueError(f"{led_count} leds need {bit_count(led_count)} bits but only {captured} were captured at "
+                         f"{angle} degrees. Leave out -n to decode the bits that were captured.")
+
+    dark = read(f"dark_{angle:03}.jpg")
+    lit = read(f"leds_angle{angle:03}.jpg")
+    labels, count, x, y, peak = find_blobs(lit, dark)
+    flat = labels.ravel()
+
+    bits = bit_count(led_count)
+    codes = np.zeros(count, dtype=int)
+    confidence = np.ones(count)
+    for bit in range(bits):
+        # Total brightness of each blob in the image and its inverse
+        on = np.bincount(flat, weights=cv2.subtract(read(pattern_file_name(bit, angle)), dark).ravel(),
+                         minlength=count)
+        off = np.bincount(flat, weights=cv2.subtract(read(pattern_file_name(bit, angle, inverse=True)), dark).ravel(),
+                          minlength=count)
+        codes |= (on > off).astype(int) << bit
+        with np.errstate(invalid="ignore", divide="ignore"):
+            confidence = np.minimum(confidence, np.nan_to_num(np.abs(on - off) / (on + off)))
+
+    led_ids = from_gray(codes)
+
+    # When two blobs decode to the same id, keep the one that was read most clearly.
+    best = {}
+    for label in range(1, count):
+        if not peak[label] or led_ids[label] >= led_count:
+            continue
+        led_id = int(led_ids[label])
+        if led_id not in best or confidence[label] > confidence[best[led_id]]:
+            best[led_id] = label
+
+    return [Coord2d(led_id, angle, round(float(x[label]), 2), round(float(y[label]), 2), float(peak[label]),
+                    round(float(confidence[label]), 3))
+            for led_id, label in sorted(best.items())]
+
+
+def main():
+    """
+    Decodes the pattern images of every angle into a CSV of Coord2d json lines ordered by led and then angle, the same
+    as s2.
+    Flags:
+      -i the relative folder of the captured images.
+      -o the relative folder of the output file.
+      -n (optional) the number of leds on the strand. Ex: 500. Defaults to what the captured bits can tell apart.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--input-folder', type=str, help='The relative folder for input files')
+    parser.add_argument('-o', '--output-folder', type=str, default="./s2", help='The relative folder for output files')
+    parser.add_argument('-n', '--led-count', type=int,
+                        help='The number of leds on the strand. Defaults to what the captured bits can tell apart.')
+    args = parser.parse_args()
+
+    input_folder = c.get_image_processing_folder(args)
+
+    out_folder = os.path.join(args.output_folder, datetime.now().strftime("%Y%m%d_%H%M"))
+    if not os.path.exists(out_folder):
+        print(f"Make output directory: {out_folder}")
+        os.makedirs(out_folder)
+    out_file = os.path.join(out_folder, "processed_images.csv")
+
+    detections = []
+    for angle in ANGLES:
+        if not os.path.exists(os.path.join(input_folder, pattern_file_name(0, angle))):
+            print(f"Skipping angle {angle}. No pattern images found.")
+            continue
+        try:
+            found = decode_angle(input_folder, angle, args.led_count)
+        except ValueError as e:
+            print(f"{e} Exiting.")
+            sys.exit(1)
+        print(f"Found {len(found)} leds at {angle} degrees")
+        detections.extend(found)
+
+    detections.sort(key=lambda coord2d: (coord2d.led_id, coord2d.angle))
+    with open(out_file, 'w') as f:
+        for coord2d in detections:
+            f.write(coord2d.to_json() + "\n")
+
+    c.write_continue_file(images_folder=input_folder, twod_coordinates_file=out_file)
+    print(f"Results written to {os.path.abspath(out_file)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""Real-time 3D preview of the tree in a pygame window. Frames come from a baked animation csv or over gRPC, the same
+way the real tree receives them.
+
+Usage:
+  python3 -m utils.live_preview coords_2021.csv -a examples/test.csv
+  python3 -m utils.live_preview coords_2021.csv --serve
+
+Controls: left/right rotates the tree, up/down changes the camera elevation, space toggles spinning, esc quits.
+"""
+import argparse
+import math
+import threading
+import time
+from concurrent import futures
+
+import grpc
+import numpy as np
+import pygame
+
+from network import lights_pb2_grpc, lights_pb2
+from utils.animation import z_rotation_matrix
+from utils.coordinate_cache import load_points
+from utils.frames import FrameSource
+
+TARGET_FPS = 60
+BACKGROUND = (25, 25, 25)
+SPIN_SPEED = 30  # deg / s
+ROTATE_SPEED = 90  # deg / s
+
+
+class LivePreview:
+    def __init__(self, points, width=600, height=800, point_size=3, margin=.05):
+        """Renders the tree from any angle. Each frame is one matrix multiply to rotate / project the coordinates, a depth
+        sort and a scatter of the LED colors into the window's pixel buffer.
+
+        Args:
+            points (np.array): The (N, 3) LED coordinates
+            width (int, optional): The width of the window [px]. Defaults to 600.
+            height (int, optional): The height of the window [px]. Defaults to 800.
+            point_size (int, optional): The radius of each LED [px]. Defaults to 3.
+            margin (float, optional): The ratio of the window left empty around the tree. Defaults to .05.
+        """
+        self.width = width
+        self.height = height
+
+        # Center on the trunk and scale so the tree fits the window no matter how it is rotated.
+        points = np.asarray(points, dtype=float)
+        center = (points.min(axis=0) + points.max(axis=0)) / 2
+        self.points = points - center
+        radius = max(np.linalg.norm(self.points, axis=1).max(), 1e-9)
+        self.scale = (1 - 2 * margin) * min(width, height) / (2 * radius)
+
+        r = point_size
+        dy, dx = np.mgrid[-r:r + 1, -r:r + 1]
+        in_disc = (dx * dx + dy * dy) <= r * r
+        self._dx = dx[in_disc]
+        self._dy = dy[in_disc]
+
+        # Pixels are packed into one int each so the scatter moves a single value per pixel. pygame pixel arrays are
+        # indexed [x][y].
+        self._buffer = np.empty((width, height), dtype=np.uint32)
+
+    def render(self, surface, colors, azimuth, elevation):
+        """Draws the tree lit with the (N, 3) colors onto the surface."""
+        e = math.radians(elevation)
+        tilt = np.array([[1, 0, 0], [0, math.cos(e), math.sin(e)], [0, -math.sin(e), math.cos(e)]])
+        projected = self.points @ (tilt @ z_rotation_matrix(float(azimuth))).T
+
+        cols = np.rint(self.width / 2 + projected[:, 0] * self.scale).astype(int)
+        rows = np.rint(self.height / 2 - projected[:, 2] * self.scale).astype(int)
+
+        # Draw back to front so that nearer LEDs cover the ones behind them.
+        order = np.argsort(projected[:, 1])
+        disc_cols = (cols[order][:, None] + self._dx[None, :]).ravel()
+        disc_rows = (rows[order][:, None] + self._dy[None, :]).ravel()
+        visible = (disc_rows >= 0) & (disc_rows < self.height) & (disc_cols >= 0) & (disc_cols < self.width)
+        sources = np.repeat(order, len(self._dx))[visible]
+
+        packed = _pack(surface, np.asarray(colors))
+        self._buffer[:] = _pack(surface, np.array([BACKGROUND]))[0]
+        self._buffer.reshape(-1)[(disc_cols * self.height + disc_rows)[visible]] = packed[sources]
+        pygame.surfarray.blit_array(surface, self._buffer)
+
+
+def _pack(surface, colors):
+    """Packs (N, 3) rgb colors into the pixel format of the surface."""
+    r_shift, g_shift, b_shift, _ = surface.get_shifts()
+    colors = colors.astype(np.uint32)
+    return (colors[:, 0] << r_shift) | (colors[:, 1] << g_shift) | (colors[:, 2] << b_shift)
+
+
+class LightsServicer(lights_pb2_grpc.LightsServicer):
+    """Keeps the latest frame sent over gRPC."""
+
+    def __init__(self, led_count):
+        self._lock = threading.Lock()
+        self._colors = np.zeros((led_count, 3), dtype=np.uint8)
+
+    def SetLights(self, request, context):
+        ids = np.fromiter((p.pix_id for p in request.pix), dtype=np.int64, count=len(request.pix))
+        rgb = np.fromiter((p.rgb for p in request.pix), dtype=np.int64, count=len(request.pix))
+        in_range = (ids >= 0) & (ids < len(self._colors))
+        ids, rgb = ids[in_range], rgb[in_range]
+
+        colors = np.zeros_like(self._colors)
+        colors[ids] = np.stack([(rgb >> 16) & 255, (rgb >> 8) & 255, rgb & 255], axis=1)
+        with self._lock:
+            self._colors = colors
+
+        return lights_pb2.SetLightsResponse(is_successful=True)
+
+    def latest(self):
+        with self._lock:
+            return self._colors
+
+
+def run(coords_file, animation_file=None, serve=False, port=50051, width=600, height=800, point_size=3):
+    points = load_points(coords_file)
+
+    server = None
+    servicer = None
+    frames = None
+    if serve:
+        servicer = LightsServicer(len(points))
+        server = grpc.server(futures.ThreadPoolExecutor(max_workers=1))
+        lights_pb2_grpc.add_LightsServicer_to_server(servicer, server)
+        server.add_insecure_port(f'[::]:{port}')
+        server.start()
+        print(f"Server started on port {port}...")
+    else:
+        frames = FrameSource(animation_file, header=True)
+        if not len(frames):
+            print(f"No frames found in {animation_file}")
+            return
+
+    pygame.init()
+    surface = pygame.display.set_mode((width, height))
+    preview = LivePreview(points, width=width, height=height, point_size=point_size)
+
+    clock = pygame.time.Clock()
+    azimuth = 0.0
+    elevation = 10.0
+    spin = True
+    frame_idx = 0
+    last_report = time.perf_counter()
+
+    try:
+        while True:
+            for e in pygame.event.get():
+                if e.type == pygame.QUIT or (e.type == pygame.KEYDOWN and e.key == pygame.K_ESCAPE):
+                    return
+                if e.type == pygame.KEYDOWN and e.key == pygame.K_SPACE:
+                    spin = not spin
+
+            dt = clock.get_time() / 1000
+            keys = pygame.key.get_pressed()
+            azimuth += ((keys[pygame.K_RIGHT] - keys[pygame.K_LEFT]) * ROTATE_SPEED + (SPIN_SPEED if spin else 0)) * dt
+            elevation = min(max(elevation + (keys[pygame.K_UP] - keys[pygame.K_DOWN]) * ROTATE_SPEED * dt, -90), 90)
+
+            if frames is not None:
+                colors = frames[frame_idx][1:].reshape(-1, 3).astype(np.uint8)
+                frame_idx = (frame_idx + 1) % len(frames)
+            else:
+                colors = servicer.latest()
+
+            preview.render(surface, colors, azimuth % 360, elevation)
+            pygame.display.flip()
+            clock.tick(TARGET_FPS)
+
+            now = time.perf_counter()
+            if now - last_report > 1:
+                pygame.display.set_caption(f"Tree preview - {clock.get_fps():.1f} fps")
+                print(f"Average FPS: {clock.get_fps():.1f}", end="\r")
+                last_report = now
+    finally:
+        pygame.quit()
+        if server:
+            server.stop(None)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('coords_file', type=str, help='The file with the tree coordinates.')
+    parser.add_argument('-a', '--animation-file', type=str, help='The animation csv to play.')
+    parser.add_argument('--serve', action='store_true', help='Show frames sent to a gRPC Lights service instead.')
+    parser.add_argument('--port', type=int, default=50051, help='The port to serve on.')
+    parser.add_argument('-W', '--width', type=int, default=600, help='The width of the window [px].')
+    parser.add_argument('-H', '--height', type=int, default=800, help='The height of the window [px].')
+    parser.add_argument('-p', '--point-size', type=int, default=3, help='The radius of each LED [px].')
+    args = parser.parse_args()
+
+    if not args.serve and not args.animation_file:
+        parser.error("Either an animation file (-a) or --serve is required.")
+
+    run(args.coords_file, animation_file=args.animation_file, serve=args.serve, port=args.port, width=args.width,
+        height=args.height, point_size=args.point_size)
+
+
+if __name__ == '__main__':
+    main()
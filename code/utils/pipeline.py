@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+"""Runs the stages from capturing the tree to playing an animation on it. Each stage is given the files of the stages
+before it directly instead of reading them from `.continue.txt`.
+
+Every stage's output is kept in the work folder under a hash of the stage's settings, its script, the modules the
+script imports and the content of its inputs. Stages that were already run with the same hash are skipped, so changing
+a setting of one stage only reruns that stage and the ones whose inputs actually changed. Stages that don't depend on
+each other run at the same time. The time each stage took is printed at the end and appended to
+`<work folder>/timings.jsonl`.
+
+Stage settings are the stage script's own flags in one string. Use `=` so they aren't read as flags of the pipeline.
+Reconstruct and bake captures that were already taken:
+
+  python3 -m utils.pipeline --captures tree_captures --detect="-d background" --reconstruct="-l -s"
+
+Capture a simulated tree, calibrate the camera and bake two animations:
+
+  python3 -m utils.pipeline --capture="--simulate s3/hat_tree_coords_2021_v2.csv -w 0 -a" --calibrate="" \\
+      --bake="-x y" --bake="-x z"
+"""
+import argparse
+import ast
+import glob
+import hashlib
+import json
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import time
+from collections import namedtuple
+from concurrent import futures
+from datetime import datetime
+
+from utils.continuation import NO_CONTINUE_ENV
+
+# The folder with the stage scripts. Stages run from here, the same as when they are run by hand.
+CODE_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Files are read in chunks of this many bytes when hashing.
+CHUNK_SIZE = 1 << 20
+
+# A stage of the pipeline.
+#   inputs: the names of the artifacts the stage reads.
+#   output: the name of the artifact the stage writes. None for stages that only have side effects (play).
+#   script: the file the stage runs. Its content and that of the modules it imports from this repository are part of
+#     the stage's hash.
+#   settings: the extra arguments given to the script. Part of the stage's hash.
+#   command: a function of (input paths, output folder) that returns the arguments to run python with.
+#   output_glob: where the output is in the output folder. '' for the folder itself.
+#   interactive: stages that need the terminal (prompts, Ctrl-C) print to it instead of a log file.
+Stage = namedtuple('Stage', 'name inputs output script settings command output_glob interactive')
+
+
+class StageError(Exception):
+    pass
+
+
+def file_hash(file_name):
+    sha = hashlib.sha256()
+    with open(file_name, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def content_hash(path, hash_file=file_hash):
+    """Returns the hash of the file or of the names and content of every file in the folder."""
+    if os.path.isfile(path):
+        return hash_file(path)
+
+    sha = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            file_name = os.path.join(root, name)
+            sha.update(os.path.relpath(file_name, path).encode())
+            sha.update(hash_file(file_name).encode())
+    return sha.hexdigest()
+
+
+class HashStore:
+    def __init__(self, file_name):
+        """Hashes files and folders by their content. Hashes are remembered by path, size and modification time so
+        hours of captures are only read once.
+
+        Args:
+            file_name (str): The json file the hashes are remembered in.
+        """
+        self.file_name = file_name
+        self._known = {}
+        if os.path.isfile(file_name):
+            with open(file_name, 'r') as f:
+                self._known = json.load(f)
+
+    def hash(self, path):
+        return content_hash(path, self._file)
+
+    def _file(self, file_name):
+        stat = os.stat(file_name)
+        key = os.path.abspath(file_name)
+        known = self._known.get(key)
+        if known and known[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return known[2]
+        digest = file_hash(file_name)
+        self._known[key] = [stat.st_size, stat.st_mtime_ns, digest]
+        return digest
+
+    def save(self):
+        with open(self.file_name, 'w') as f:
+            json.dump(self._known, f)
+
+
+def stage_key(stage, input_hashes):
+    """The hash a stage's output is stored under."""
+    code = [[os.path.relpath(file_name, CODE_FOLDER), file_hash(file_name)] for file_name in script_files(stage.script)]
+    description = [stage.name, stage.settings, code or stage.script, [input_hashes[name] for name in stage.inputs]]
+    return hashlib.sha256(json.dumps(description).encode()).hexdigest()
+
+
+def script_files(script):
+    """Returns the script and every module of this repository that it imports, directly or through other modules."""
+    found = set()
+    pending = [os.path.join(CODE_FOLDER, script)]
+    while pending:
+        file_name = pending.pop()
+        if file_name in found or not os.path.isfile(file_name):
+            continue
+        found.add(file_name)
+        with open(file_name, 'r') as f:
+            tree = ast.parse(f.read(), file_name)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                modules = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                # `from utils import calibration` imports a module, `from utils.shots import ANGLES` doesn't.
+                modules = [node.module] + [f"{node.module}.{alias.name}" for alias in node.names]
+            else:
+                continue
+            for module in modules:
+                path = os.path.join(CODE_FOLDER, *module.split("."))
+                pending += [path + ".py", os.path.join(path, "__init__.py")]
+    return sorted(found)
+
+
+def run_stage(stage, inputs, key, work_folder, force=False):
+    """
+    Runs the stage unless its output for the key already exists. Returns the path of the output, the hash of its
+    content and whether the stage ran.
+    """
+    folder = os.path.join(work_folder, stage.name, key[:16])
+    record_file = os.path.join(folder, "stage.json")
+    if stage.output and not force and os.path.isfile(record_file):
+        with open(record_file, 'r') as f:
+            record = json.load(f)
+        return os.path.join(folder, record["output"]), record["hash"], False
+
+    # Write to a temporary folder so a stage that fails or is stopped never looks finished.
+    tmp_folder = folder + ".tmp"
+    shutil.rmtree(tmp_folder, ignore_errors=True)
+    os.makedirs(tmp_folder)
+
+    argv = [sys.executable] + stage.command(inputs, tmp_folder)
+    # Stages get their inputs from the pipeline so they leave the continuation file alone.
+    env = dict(os.environ, **{NO_CONTINUE_ENV: "1"})
+    log_file = os.path.join(tmp_folder, "stage.log")
+    if stage.interactive:
+        result = subprocess.run(argv, cwd=CODE_FOLDER, env=env)
+    else:
+        with open(log_file, 'w') as log:
+            result = subprocess.run(argv, cwd=CODE_FOLDER, env=env, stdout=log, stderr=subprocess.STDOUT)
+    if result.returncode:
+        raise StageError(f"{stage.name} failed with exit code {result.returncode}: {' '.join(argv)}" +
+                         ("" if stage.interactive else f"\nSee {log_file}"))
+    if not stage.output:
+        shutil.rmtree(tmp_folder, ignore_errors=True)
+        return None, None, True
+
+    shutil.rmtree(folder, ignore_errors=True)
+    os.rename(tmp_folder, folder)
+
+    matches = sorted(glob.glob(os.path.join(folder, stage.output_glob))) if stage.output_glob else [folder]
+    if not matches:
+        raise StageError(f"{stage.name} finished without writing {stage.output_glob} to {folder}")
+    output = matches[-1]
+    digest = content_hash(output)
+    with open(record_file, 'w') as f:
+        json.dump({"output": os.path.relpath(output, folder), "hash": digest, "settings": stage.settings}, f)
+    return output, digest, True
+
+
+def run(stages, artifacts, work_folder, jobs=4, force=()):
+    """
+    Runs the stages as soon as their inputs are ready, up to `jobs` at a time.
+
+    Args:
+        stages (list): The stages to run.
+        artifacts (dict): The name and path of inputs that exist before the pipeline runs (eg: the captures).
+        work_folder (str): Where stage outputs are kept.
+        jobs (int, optional): The most stages to run at once. Defaults to 4.
+        force (list, optional): The names of stages to rerun even if their output exists.
+
+    Returns the list of (stage name, status, seconds) in the order the stages finished.
+    """
+    store = HashStore(os.path.join(work_folder, "hashes.json"))
+    paths = dict(artifacts)
+    hashes = {name: store.hash(path) for name, path in artifacts.items()}
+    store.save()
+
+    pending = list(stages)
+    running = {}
+    timings = []
+    with futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+        while pending or running:
+            # Interactive stages have the terminal to themselves.
+            for stage in [s for s in pending if all(name in paths for name in s.inputs)]:
+                if running and (stage.interactive or any(s.interactive for s in running.values())):
+                    continue
+                key = stage_key(stage, hashes)
+                print(f"{stage.name}: starting")
+                running[pool.submit(_timed, run_stage, stage, {name: paths[name] for name in stage.inputs}, key,
+                                    work_folder, stage.name in force)] = stage
+                pending.remove(stage)
+
+            if not running:
+                for stage in pending:
+                    timings.append((stage.name, "blocked", 0))
+                break
+
+            done, _ = futures.wait(running, return_when=futures.FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                try:
+                    (output, digest, ran), seconds = future.result()
+                except (StageError, KeyboardInterrupt) as e:
+                    print(f"{stage.name}: {e}")
+                    timings.append((stage.name, "failed", 0))
+                    continue
+
+                timings.append((stage.name, "ran" if ran else "skipped", seconds))
+                print(f"{stage.name}: {'done' if ran else 'unchanged'} in {seconds:.1f}s" +
+                      (f" -> {output}" if output else ""))
+                if stage.output:
+                    paths[stage.output] = output
+                    hashes[stage.output] = digest
+
+    return timings
+
+
+def _timed(f, *args):
+    start = time.perf_counter()
+    result = f(*args)
+    return result, time.perf_counter() - start
+
+
+def build_stages(args):
+    """Returns the stages for the command line arguments."""
+    stages = []
+    if args.capture is not None:
+        settings = shlex.split(args.capture)
+        stages.append(Stage("capture", [], "captures", "s1_capture_images.py", settings,
+                            lambda inputs, out: ["s1_capture_images.py"] + settings + ["-o", out], "", True))
+
+    detect = shlex.split(args.detect)
+    if args.gray_code:
+        stages.append(Stage("detect", ["captures"], "detections", "utils/gray_code.py", detect,
+                            lambda inputs, out: ["-m", "utils.gray_code"] + detect +
+                                                ["-i", inputs["captures"], "-o", out],
+                            "*/processed_images.csv", False))
+    else:
+        stages.append(Stage("detect", ["captures"], "detections", "s2_image_processing.py", detect,
+                            lambda inputs, out: ["s2_image_processing.py"] + detect +
+                                                ["-i", inputs["captures"], "-o", out,
+                                                 "--cache-folder", os.path.join(os.path.dirname(out), "cache")],
+                            "*/processed_images.csv", False))
+
+    reconstruct_inputs = ["detections"]
+    if args.calibrate is not None:
+        calibrate = shlex.split(args.calibrate)
+        stages.append(Stage("calibrate", ["detections"], "camera", "utils/calibration.py", calibrate,
+                            lambda inputs, out: ["-m", "utils.calibration"] + calibrate +
+                                                ["-i", inputs["detections"], "-o", os.path.join(out, "camera.json")],
+                            "camera.json", False))
+        reconstruct_inputs.append("camera")
+
+    # Plots are saved next to the coordinates unless the settings ask for something else.
+    reconstruct = shlex.split(args.reconstruct)
+    plots = [] if {"-p", "--plots"} & set(reconstruct) else ["-p", "save"]
+    stages.append(Stage("reconstruct", reconstruct_inputs, "coordinates", "s3_coordinate_processing.py", reconstruct,
+                        lambda inputs, out: ["s3_coordinate_processing.py"] + reconstruct + plots +
+                                            (["-c", inputs["camera"]] if "camera" in inputs else []) +
+                                            ["-i", inputs["detections"], "-o", out],
+                        "????????_????.csv", False))
+
+    bakes = args.bake or [""]
+    for i, bake in enumerate(bakes):
+        suffix = "" if len(bakes) == 1 else str(i + 1)
+        stages.append(_bake_stage(f"bake{suffix}", f"animation{suffix}", shlex.split(bake)))
+
+    if args.play:
+        animation = stages[-len(bakes)].output
+        stages.append(Stage("play", [animation], None, "s5_run_animation.py", [],
+                            lambda inputs, out: ["s5_run_animation.py", "-i", inputs[animation]], "", True))
+    return stages
+
+
+def _bake_stage(name, output, settings):
+    return Stage(name, ["coordinates"], output, "s4_test_animations.py", settings,
+                 lambda inputs, out: ["s4_test_animations.py"] + settings +
+                                     ["-i", inputs["coordinates"], "-o", os.path.join(out, "animation.csv"),
+                                      "--no-preview"],
+                 "animation.csv", False)
+
+
+def main():
+    """
+    Runs the pipeline. Stage settings are given as one quoted string of the stage script's own flags after a `=`.
+    Flags:
+      --captures the folder of images that were already captured. Or --capture to capture them.
+      --capture (optional) capture the tree with s1 using these flags. Ex: --capture="-a -w 200"
+      --detect (optional) s2 flags. Ex: --detect="-d background"
+      --gray-code (optional) decode Gray code captures instead of running s2.
+      --calibrate (optional) calibrate the camera with these flags and use it in s3. Ex: --calibrate=""
+      --reconstruct (optional) s3 flags. Ex: --reconstruct="-l -s"
+      --bake (optional, repeatable) s4 flags of an animation to bake. Ex: --bake="-x y"
+      --play (optional) play the (first) baked animation on the tree.
+      -w (optional) the folder stage outputs are kept in. Defaults to ./pipeline
+      -j (optional) the most stages to run at once.
+      -f (optional, repeatable) rerun the stage even if nothing changed. Ex: -f detect
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--captures', type=str, help='The folder of images that were already captured.')
+    parser.add_argument('--capture', type=str, metavar='FLAGS', help='Capture the tree with these s1 flags.')
+    parser.add_argument('--detect', type=str, default="", metavar='FLAGS', help='The s2 flags.')
+    parser.add_argument('--gray-code', action='store_true', help='Decode Gray code captures instead of running s2.')
+    parser.add_argument('--calibrate', type=str, metavar='FLAGS',
+                        help='Calibrate the camera with these utils.calibration flags and use it in s3.')
+    parser.add_argument('--reconstruct', type=str, default="", metavar='FLAGS', help='The s3 flags.')
+    parser.add_argument('--bake', type=str, action='append', metavar='FLAGS',
+                        help='The s4 flags of an animation to bake. Repeat to bake several animations.')
+    parser.add_argument('--play', action='store_true', help='Play the first baked animation on the tree.')
+    parser.add_argument('-w', '--work-folder', type=str, default="./pipeline", help='Where stage outputs are kept.')
+    parser.add_argument('-j', '--jobs', type=int, default=4, help='The most stages to run at once.')
+    parser.add_argument('-f', '--force', type=str, action='append', default=[], metavar='STAGE',
+                        help='Rerun the stage even if its inputs have not changed.')
+    args = parser.parse_args()
+
+    if (args.captures is None) == (args.capture is None):
+        parser.error("Give either --captures <folder> or --capture <s1 flags>.")
+
+    work_folder = os.path.abspath(args.work_folder)
+    if not os.path.exists(work_folder):
+        os.makedirs(work_folder)
+
+    artifacts = {"captures": os.path.abspath(args.captures)} if args.captures else {}
+    stages = build_stages(args)
+
+    start = time.perf_counter()
+    try:
+        timings = run(stages, artifacts, work_folder, jobs=args.jobs, force=args.force)
+    except KeyboardInterrupt:
+        print("\nStopped. Finished stages are kept and skipped on the next run.")
+        return
+
+    print(f"\n{'Stage':<14}{'Status':<10}{'Time':>10}")
+    for name, status, seconds in timings:
+        print(f"{name:<14}{status:<10}{seconds:>9.1f}s")
+    print(f"Took {time.perf_counter() - start:.1f}s")
+
+    run_time = datetime.now().isoformat(timespec="seconds")
+    with open(os.path.join(work_folder, "timings.jsonl"), 'a') as f:
+        for name, status, seconds in timings:
+            f.write(json.dumps({"run": run_time, "stage": name, "status": status, "seconds": round(seconds, 3)}) +
+                    "\n")
+
+    if any(status != "skipped" and status != "ran" for _, status, _ in timings):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""Renders a baked animation CSV to a video, gif or png sequence without opening a window.
+
+Usage: python3 -m utils.preview coords_2021.csv examples/test.csv -o preview.mp4 [--azimuth 30] [--elevation 15]
+"""
+import argparse
+import math
+import os
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from utils.animation import rotate_points
+from utils.coordinate_cache import load_points
+from utils.frames import FrameSource
+
+BACKGROUND = (25, 25, 25)
+
+
+class Camera:
+    def __init__(self, width=360, height=640, azimuth=0, elevation=10, point_size=3, margin=.05):
+        """An orthographic camera looking at the front of the tree.
+
+        Args:
+            width (int, optional): The width of the rendered image [px]. Defaults to 360.
+            height (int, optional): The height of the rendered image [px]. Defaults to 640.
+            azimuth (int, optional): Rotation of the tree about the trunk [deg]. Defaults to 0.
+            elevation (int, optional): How far above the tree the camera looks down from [deg]. Defaults to 10.
+            point_size (int, optional): The radius of each LED [px]. Defaults to 3.
+            margin (float, optional): The ratio of the image left empty around the tree. Defaults to .05.
+        """
+        self.width = width
+        self.height = height
+        self.azimuth = azimuth
+        self.elevation = elevation
+        self.point_size = point_size
+        self.margin = margin
+
+    def project(self, points):
+        """Returns the (cols, rows, depth) of each point in the image. Larger depths are closer to the camera."""
+        rotated = rotate_points(points, self.azimuth)
+
+        e = math.radians(self.elevation)
+        x = rotated[:, 0]
+        up = rotated[:, 2] * math.cos(e) - rotated[:, 1] * math.sin(e)
+        depth = rotated[:, 1] * math.cos(e) + rotated[:, 2] * math.sin(e)
+
+        # Scale uniformly so the whole tree fits in the image.
+        span_x = max(np.ptp(x), 1e-9)
+        span_up = max(np.ptp(up), 1e-9)
+        usable = 1 - 2 * self.margin
+        scale = min(self.width * usable / span_x, self.height * usable / span_up)
+
+        cols = (self.width / 2) + (x - (x.min() + x.max()) / 2) * scale
+        rows = (self.height / 2) - (up - (up.min() + up.max()) / 2) * scale
+        return np.rint(cols).astype(int), np.rint(rows).astype(int), depth
+
+
+class PreviewRenderer:
+    def __init__(self, points, camera: Camera, background=BACKGROUND):
+        """Splats LED colors into an image buffer. The projection and draw order are computed once so rendering a frame
+        is a single scatter into the buffer.
+
+        Args:
+            points (np.array): The (N, 3) LED coordinates
+            camera (Camera): The camera to render from
+            background (tuple, optional): The rgb color behind the tree.
+        """
+        self.camera = camera
+        self._background = np.empty((camera.height, camera.width, 3), dtype=np.uint8)
+        self._background[:] = background
+
+        cols, rows, depth = camera.project(np.asarray(points, dtype=float))
+
+        # Every pixel offset of a disc with the LED radius
+        r = camera.point_size
+        dy, dx = np.mgrid[-r:r + 1, -r:r + 1]
+        in_disc = (dx * dx + dy * dy) <= r * r
+        dy, dx = dy[in_disc], dx[in_disc]
+
+        # Draw back to front so that nearer LEDs cover the ones behind them.
+        order = np.argsort(depth, kind="stable")
+        disc_rows = (rows[order][:, None] + dy[None, :]).ravel()
+        disc_cols = (cols[order][:, None] + dx[None, :]).ravel()
+        visible = (disc_rows >= 0) & (disc_rows < camera.height) & (disc_cols >= 0) & (disc_cols < camera.width)
+
+        self._pixels = (disc_rows * camera.width + disc_cols)[visible]
+        self._sources = np.repeat(order, len(dy))[visible]
+
+    def render(self, colors):
+        """Returns an (H, W, 3) rgb image of the tree lit with the (N, 3) colors."""
+        image = self._background.copy()
+        image.reshape(-1, 3)[self._pixels] = np.asarray(colors, dtype=np.uint8)[self._sources]
+        return image
+
+
+def render_animation(coords_file, animation_file, output, camera: Camera, fps=30, step=1, start=0, end=None,
+                     verbose=True):
+    """
+    Renders the animation to `output`. `.mp4` / `.avi` files are encoded with OpenCV, `.gif` files with PIL and
+    anything else is treated as a folder to write a png per frame.
+    """
+    points = load_points(coords_file)
+    frames = FrameSource(animation_file, header=True, step=step, start=start, end=end)
+    renderer = PreviewRenderer(points, camera)
+
+    extension = os.path.splitext(output)[1].lower()
+    writer = None
+    gif_frames = []
+    if extension in [".mp4", ".avi"]:
+        fourcc = cv2.VideoWriter_fourcc(*("mp4v" if extension == ".mp4" else "MJPG"))
+        writer = cv2.VideoWriter(output, fourcc, fps, (camera.width, camera.height))
+    elif extension != ".gif" and not os.path.exists(output):
+        os.makedirs(output)
+
+    start_time = time.perf_counter()
+    for idx in range(len(frames)):
+        colors = frames[idx][1:].reshape(-1, 3)
+        if len(colors) != len(points):
+            raise ValueError(f"Number of LED's on tree ({len(points)}) does not match number of LED's in animation "
+                             f"({len(colors)})")
+
+        image = renderer.render(colors)
+        if writer:
+            writer.write(cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
+        elif extension == ".gif":
+            gif_frames.append(Image.fromarray(image))
+        else:
+            cv2.imwrite(os.path.join(output, f"frame{frames.frame_number(idx):05}.png"),
+                        cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
+
+        if verbose:
+            print(f"Frame {idx + 1:03} / {len(frames):03}", end="\r")
+
+    if writer:
+        writer.release()
+    elif gif_frames:
+        gif_frames[0].save(output, save_all=True, append_images=gif_frames[1:], duration=int(1000 / fps), loop=0)
+
+    duration = time.perf_counter() - start_time
+    if verbose:
+        print(f"Rendered {len(frames)} frames to {os.path.abspath(output)} in {duration:.2f}s "
+              f"({len(frames) / max(duration, 1e-9):.1f} fps)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('coords_file', type=str, help='The file with the tree coordinates.')
+    parser.add_argument('animation_file', type=str, help='The animation csv to render.')
+    parser.add_argument('-o', '--output', type=str, default='preview.mp4',
+                        help='The .mp4 / .avi / .gif file or the folder for a png sequence.')
+    parser.add_argument('-f', '--fps', type=int, default=30, help='Frames per second of the output.')
+    parser.add_argument('-W', '--width', type=int, default=360, help='The width of the output [px].')
+    parser.add_argument('-H', '--height', type=int, default=640, help='The height of the output [px].')
+    parser.add_argument('-a', '--azimuth', type=int, default=0, help='Rotation of the tree [deg].')
+    parser.add_argument('-l', '--elevation', type=int, default=10, help='Camera elevation [deg].')
+    parser.add_argument('-p', '--point-size', type=int, default=3, help='The radius of each LED [px].')
+    parser.add_argument('-k', '--step', type=int, default=1, help='Only render every k-th frame.')
+    parser.add_argument('-s', '--start', type=int, default=0, help='The first frame to render.')
+    parser.add_argument('-e', '--end', type=int, default=None, help='The frame to stop at (exclusive).')
+    args = parser.parse_args()
+
+    camera = Camera(width=args.width, height=args.height, azimuth=args.azimuth, elevation=args.elevation,
+                    point_size=args.point_size)
+    render_animation(args.coords_file, args.animation_file, args.output, camera, fps=args.fps, step=args.step,
+                     start=args.start, end=args.end)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,28 @@
+import time
+
+
+class Progress:
+    """Prints a single updating line with the throughput and estimated time remaining of a batch of work."""
+
+    def __init__(self, total, label="images"):
+        self.total = total
+        self.label = label
+        self.count = 0
+        self.start = time.perf_counter()
+
+    def update(self, n=1):
+        self.count += n
+        elapsed = self.elapsed()
+        rate = self.count / elapsed if elapsed > 0 else 0
+        eta = (self.total - self.count) / rate if rate > 0 else 0
+        print(f"{self.count}/{self.total} {self.label} | {rate:.1f} {self.label}/s | ETA {_format_seconds(eta)}   ",
+              end="\r")
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+
+def _format_seconds(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:d}:{minutes:02d}:{seconds:02d}"
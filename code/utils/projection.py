@@ -0,0 +1,121 @@
+import math
+
+import numpy as np
+
+from utils.coords import CoordinateStore
+
+PLANAR = "planar"
+CYLINDRICAL = "cylindrical"
+SPHERICAL = "spherical"
+PROJECTIONS = [PLANAR, CYLINDRICAL, SPHERICAL]
+
+
+class ImageProjection:
+    """
+    Maps images onto the tree. The position of each LED in the image is computed once for the chosen projection so
+    sampling a frame is a single numpy gather instead of a `getpixel` call per LED.
+
+    Projections:
+      * planar - the image faces the front of the tree with x running left-right and z bottom-top.
+      * cylindrical - the image is wrapped around the trunk with z bottom-top.
+      * spherical - the image is wrapped around a sphere centered in the middle of the tree.
+    """
+
+    def __init__(self, coordinates, projection=PLANAR):
+        if projection not in PROJECTIONS:
+            raise ValueError(f"Unknown projection {projection}. Expected one of {PROJECTIONS}")
+
+        store = CoordinateStore.from_dict(coordinates)
+        self.led_ids = store.led_ids.copy()
+        self.projection = projection
+
+        # Normalized [0, 1] image coordinates where (0, 0) is the top left of the image.
+        self.u, self.v = _project(store.points.astype(float), projection)
+
+        # Pixel indices, cached per image shape.
+        self._pixels = {}
+
+    def __len__(self):
+        return len(self.led_ids)
+
+    def pixels(self, height, width):
+        """Returns the (rows, cols) of each LED in an image with the given size."""
+        key = (height, width)
+        if key not in self._pixels:
+            rows = np.clip(np.rint(self.v * (height - 1)), 0, height - 1).astype(np.intp)
+            cols = np.clip(np.rint(self.u * (width - 1)), 0, width - 1).astype(np.intp)
+            self._pixels[key] = rows, cols
+        return self._pixels[key]
+
+    def sample(self, image, radius=0):
+        """
+        Returns the image value under each LED as an array ordered like `led_ids`. `image` is an (H, W) or (H, W, C)
+        array. With a radius, the mean of the (2 * radius + 1) square box around the LED is returned instead.
+        """
+        image = np.asarray(image)
+        rows, cols = self.pixels(image.shape[0], image.shape[1])
+
+        if radius <= 0:
+            return image[rows, cols]
+
+        return self._box_mean(integral_image(image), rows, cols, radius).astype(image.dtype)
+
+    def coverage(self, mask, radius):
+        """
+        Returns the fraction [0, 1] of the pixels in the box around each LED where `mask` is set. Eg:
+        `coverage(img[..., 0] > 1, 10) > .5` lights the LEDs where most of the image around them is lit.
+        """
+        mask = np.asarray(mask, dtype=np.uint8)
+        rows, cols = self.pixels(mask.shape[0], mask.shape[1])
+        return self._box_mean(integral_image(mask), rows, cols, radius)
+
+    @staticmethod
+    def _box_mean(integral, rows, cols, radius):
+        """Averages boxes using an integral image. Boxes are clipped to the bounds of the image."""
+        height = integral.shape[0] - 1
+        width = integral.shape[1] - 1
+        top = np.clip(rows - radius, 0, height)
+        bottom = np.clip(rows + radius + 1, 0, height)
+        left = np.clip(cols - radius, 0, width)
+        right = np.clip(cols + radius + 1, 0, width)
+
+        total = integral[bottom, right] - integral[top, right] - integral[bottom, left] + integral[top, left]
+        area = ((bottom - top) * (right - left)).reshape(-1, *([1] * (total.ndim - 1)))
+        return total / area
+
+
+def integral_image(image):
+    """Returns the summed area table of the image padded with a leading row and column of zeros."""
+    image = np.asarray(image)
+    dtype = np.float64 if np.issubdtype(image.dtype, np.floating) else np.int64
+    integral = np.zeros((image.shape[0] + 1, image.shape[1] + 1) + image.shape[2:], dtype=dtype)
+    integral[1:, 1:] = image.cumsum(axis=0).cumsum(axis=1)
+    return integral
+
+
+def _project(points, projection):
+    """Returns the normalized (u, v) image coordinates of each point."""
+    x, y, z = points[:, 0], points[:, 1], points[:, 2]
+
+    if projection == PLANAR:
+        return _normalize(x), 1 - _normalize(z)
+
+    if projection == CYLINDRICAL:
+        # Same as `percent_off_true` so the seam of the image lines up with the other rotational effects.
+        u = (np.arctan2(y, x) + math.pi) / (2 * math.pi)
+        return u, 1 - _normalize(z)
+
+    center = (points.min(axis=0) + points.max(axis=0)) / 2
+    offset = points - center
+    r = np.linalg.norm(offset, axis=1)
+    u = (np.arctan2(offset[:, 1], offset[:, 0]) + math.pi) / (2 * math.pi)
+    v = np.arccos(np.divide(offset[:, 2], r, out=np.zeros_like(r), where=r > 0)) / math.pi
+    return u, v
+
+
+def _normalize(values):
+    low = values.min() if len(values) else 0
+    span = values.max() - low if len(values) else 0
+    if span == 0:
+        return np.full_like(values, .5)
+    return (values - low) / span
@@ -0,0 +1,77 @@
+"""Reading the led detections of s2 into arrays for s3 and the camera calibration."""
+import os
+import sys
+from collections import namedtuple
+
+import numpy as np
+
+from utils.coords import Coord2d
+
+ANGLES = [0, 45, 90, 135, 180, 225, 270, 315]
+# Shots dimmer than this are dropped. The led wasn't found in the image.
+MIN_BRIGHTNESS = 50
+# Shots with a detection confidence below this are dropped. See `Coord2d.c`.
+MIN_CONFIDENCE = .1
+
+
+def parse_data_file(file_name):
+    """Parses a CSV of format 'id###,angle###-x####-y#### into a list of Coordinate objects."""
+    # Check that the input file exists.
+    if not os.path.exists(f"{file_name}"):
+        print(f"Input csv file `{file_name}` not found. Exiting.")
+        sys.exit()
+
+    with open(file_name, 'r') as input_file:
+        lines = input_file.readlines()
+        lines = [line.rstrip() for line in lines]
+
+    shots = {}
+    # Parse the lines and filter ones we don't want to consider.
+    for line in lines:
+        led = Coord2d.from_json(line)
+
+        # If we weren't able to resolve the light, drop this element.
+        if (not led.x and not led.y) or led.b < MIN_BRIGHTNESS:
+            continue
+
+        # Drop shots where another light in the image was nearly as bright as the led.
+        if led.c is not None and led.c < MIN_CONFIDENCE:
+            continue
+
+        shots.setdefault(led.led_id, []).append(led)
+    return shots
+
+
+# The led pixel coordinates of every shot. `xy` is (N, angles, 2) ordered like `led_ids` and ANGLES and `b` is the
+# (N, angles) brightness. `present` marks the shots that were kept by `parse_data_file` and `valid` the ones with a
+# non-zero x and y.
+Shots = namedtuple('Shots', 'led_ids xy b present valid')
+
+
+def stack_shots(shots) -> Shots:
+    """Stacks a map of led_id to list of Coord2d into arrays. If an angle was shot twice, the first one is kept."""
+    led_ids = np.array(sorted(shots.keys()), dtype=int)
+    flat = np.array([(shot.led_id, shot.angle, shot.x, shot.y, shot.b) for led in shots.values() for shot in led],
+                    dtype=float).reshape(-1, 5)
+
+    rows = np.searchsorted(led_ids, flat[:, 0].astype(int))
+    cols = np.searchsorted(ANGLES, flat[:, 1].astype(int))
+    known = (cols < len(ANGLES)) & (np.asarray(ANGLES)[np.minimum(cols, len(ANGLES) - 1)] == flat[:, 1])
+    rows, cols, flat = rows[known], cols[known], flat[known]
+
+    # np.unique returns the index of the first occurrence of each led / angle.
+    _, first = np.unique(rows * len(ANGLES) + cols, return_index=True)
+    xy = np.zeros((len(led_ids), len(ANGLES), 2))
+    b = np.zeros((len(led_ids), len(ANGLES)))
+    present = np.zeros((len(led_ids), len(ANGLES)), dtype=bool)
+    xy[rows[first], cols[first]] = flat[first, 2:4]
+    b[rows[first], cols[first]] = flat[first, 4]
+    present[rows[first], cols[first]] = True
+
+    valid = present & (xy[..., 0] != 0) & (xy[..., 1] != 0)
+    return Shots(led_ids, xy, b, present, valid)
+
+
+def shot_weights(shots):
+    """The (N, angles) weight of every shot in the least squares fit. Brighter shots count more."""
+    return np.where(shots.valid, np.clip(shots.b / 255, .05, 1), 0)
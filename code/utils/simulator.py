@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""A simulated tree for running the capture pipeline without the hardware. The simulator stands in for both the led
+strip and the camera: lighting leds on the strip changes what the camera renders for a known set of 3d coordinates.
+
+Capture a simulated tree with s1 and compare what s3 reconstructs to the coordinates that were simulated:
+
+  python3 s1_capture_images.py --simulate s3/hat_tree_coords_2021_v2.csv -w 0 -o sim_captures
+  python3 s2_image_processing.py -i sim_captures
+  python3 s3_coordinate_processing.py
+  python3 -m utils.simulator s3/hat_tree_coords_2021_v2.csv s3/<timestamp>.csv
+"""
+import argparse
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from utils.animation import rotate_points
+from utils.coordinate_cache import load_points
+
+
+class TreeSimulator:
+    def __init__(self, points, width=1080, height=1920, led_radius=4, noise=3, occlusion=.1, trunk_radius=15,
+                 margin=.1, fps=30, focal=None, seed=0):
+        """Renders what the camera would see of leds at known 3d coordinates. Images are rendered upright (the tree's
+        z axis points up the image) and rotated to the camera's landscape orientation, the same as the real camera.
+
+        Angles follow s3: at angle 0 the image x is the tree's x, at 90 it is -y, at 180 -x and at 270 y.
+
+        Args:
+            points (np.array): The (N, 3) led coordinates. Any units, z up.
+            width (int, optional): The width of the upright image [px]. Defaults to 1080.
+            height (int, optional): The height of the upright image [px]. Defaults to 1920.
+            led_radius (int, optional): The radius of a lit led [px]. Defaults to 4.
+            noise (int, optional): The standard deviation of the sensor noise added to every frame. Defaults to 3.
+            occlusion (float, optional): The ratio of leds randomly hidden from each angle. Defaults to .1.
+            trunk_radius (int, optional): Leds behind the trunk and within this many pixels of it are hidden.
+            margin (float, optional): The ratio of the image left empty around the tree. Defaults to .1.
+            fps (int, optional): The frame rate of the camera. Defaults to 30.
+            focal (float, optional): The focal length of the camera [px]. The camera is placed so the tree's axis
+                is at the same scale as without it. Defaults to None, an orthographic camera.
+            seed (int, optional): Seed for the background, noise and occlusion. Defaults to 0.
+        """
+        self.points = np.asarray(points, dtype=float)
+        self.width = width
+        self.height = height
+        self.led_radius = led_radius
+        self.noise = noise
+        self.occlusion = occlusion
+        self.trunk_radius = trunk_radius
+        self.fps = fps
+        self.focal = focal
+        self.angle = 0
+
+        center = (self.points.min(axis=0) + self.points.max(axis=0)) / 2
+        self._offset = self.points - center
+        reach = max(np.linalg.norm(self._offset[:, :2], axis=1).max(), 1e-9)
+        span_z = max(np.ptp(self.points[:, 2]), 1e-9)
+        self._scale = (1 - 2 * margin) * min(width / (2 * reach), height / span_z)
+
+        rng = np.random.default_rng(seed)
+        self._hidden_draws = rng.random((len(self.points), 360))
+        self._noise_rng = np.random.default_rng(seed + 1)
+
+        # A dim room with a lamp in the corner that is the same in every frame.
+        background = rng.integers(0, 25, (height, width, 3)).astype(np.uint8)
+        cv2.circle(background, (width // 8, height // 10), width // 30, (180, 180, 180), -1)
+        self._background = cv2.GaussianBlur(background, (5, 5), 0)
+
+        self.strip = SimulatedStrip(len(self.points))
+        self.camera = SimulatedCamera(self)
+
+    def project(self, angle=None):
+        """Returns the upright (x, y) pixel of every led from the angle and whether the camera can see it."""
+        angle = self.angle if angle is None else angle
+        rotated = rotate_points(self._offset, angle)
+
+        # Leds further from the camera than the tree's axis look smaller.
+        magnification = 1 if self.focal is None else self.focal / (self.focal + rotated[:, 1] * self._scale)
+        x = self.width / 2 + rotated[:, 0] * self._scale * magnification
+        y = self.height / 2 - rotated[:, 2] * self._scale * magnification
+        behind_trunk = (rotated[:, 1] > 0) & (np.abs(rotated[:, 0] * self._scale) < self.trunk_radius)
+        hidden = self._hidden_draws[:, int(angle) % 360] < self.occlusion
+        return np.stack([x, y], axis=1), ~(behind_trunk | hidden)
+
+    def render(self, colors=None):
+        """Returns the camera's BGR frame of the tree lit with the (N, 3) rgb colors. Defaults to the strip."""
+        colors = self.strip.shown if colors is None else np.asarray(colors)
+        image = self._background.copy()
+
+        positions, visible = self.project()
+        lit = np.flatnonzero(visible & colors.any(axis=1))
+        for i in lit:
+            r, g, b = (int(v) for v in colors[i])
+            cv2.circle(image, (int(round(positions[i, 0])), int(round(positions[i, 1]))), self.led_radius, (b, g, r),
+                       -1, lineType=cv2.LINE_AA)
+
+        if self.noise:
+            noise = self._noise_rng.normal(0, self.noise, image.shape[:2] + (1,)).astype(np.int16)
+            image = np.clip(image + noise, 0, 255).astype(np.uint8)
+
+        return cv2.rotate(image, cv2.ROTATE_90_CLOCKWISE)
+
+
+class SimulatedStrip:
+    """Stands in for a neopixel strip. Colors set on the strip only show up in the simulator's images after `show`."""
+
+    def __init__(self, n):
+        self.n = n
+        self._pixels = np.zeros((n, 3), dtype=np.uint8)
+        self.shown = self._pixels.copy()
+
+    def __setitem__(self, key, value):
+        self._pixels[key] = value
+
+    def __getitem__(self, key):
+        return tuple(self._pixels[key].tolist())
+
+    def __len__(self):
+        return self.n
+
+    def show(self):
+        self.shown = self._pixels.copy()
+
+
+class SimulatedCamera:
+    """Stands in for a cv2.VideoCapture. Frames are rendered by the simulator at its frame rate."""
+
+    def __init__(self, simulator: TreeSimulator):
+        self.simulator = simulator
+        self._lock = threading.Lock()
+        self._next_frame = time.perf_counter()
+
+    def read(self):
+        with self._lock:
+            wait = self._next_frame - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            self._next_frame = max(self._next_frame, time.perf_counter()) + 1 / self.simulator.fps
+        return True, self.simulator.render()
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FPS:
+            return self.simulator.fps
+        return 0
+
+    def set(self, prop, value):
+        return True
+
+    def release(self):
+        pass
+
+
+def align(points, reference):
+    """
+    Returns the points moved onto the reference with the rotation (or reflection), uniform scale and translation that
+    fits them best (least squares). Reconstructed coordinates are normalized and oriented differently from the
+    simulated ones so they have to be aligned before they can be compared.
+    """
+    points = np.asarray(points, dtype=float)
+    reference = np.asarray(reference, dtype=float)
+    p_mean, r_mean = points.mean(axis=0), reference.mean(axis=0)
+    p, r = points - p_mean, reference - r_mean
+
+    u, s, vt = np.linalg.svd(r.T @ p)
+    rotation = u @ vt
+    scale = s.sum() / max((p ** 2).sum(), 1e-12)
+    return (p @ rotation.T) * scale + r_mean
+
+
+def score(truth, reconstructed):
+    """
+    Returns the error of every reconstructed led after aligning it to the truth, as a ratio of the tree's height.
+    """
+    aligned = align(reconstructed, truth)
+    return np.linalg.norm(aligned - truth, axis=1) / max(np.ptp(np.asarray(truth)[:, 2]), 1e-9)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('truth_file', type=str, help='The coordinates the simulator was run with.')
+    parser.add_argument('result_file', type=str, help='The coordinates s3 reconstructed.')
+    args = parser.parse_args()
+
+    truth = load_points(args.truth_file)
+    result = load_points(args.result_file)
+    if len(truth) != len(result):
+        raise ValueError(f"{args.truth_file} has {len(truth)} leds but {args.result_file} has {len(result)}")
+
+    errors = score(truth, result)
+    print(f"Error as a ratio of the tree height over {len(errors)} leds:")
+    print(f"  median {np.median(errors):.4f} | mean {errors.mean():.4f} | 95th percentile "
+          f"{np.percentile(errors, 95):.4f} | max {errors.max():.4f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+from utils.coords import Coord3d, CoordinateStore
+
+AXES = {"x": 0, "y": 1, "z": 2}
+
+
+class CoordinateIndex:
+    """
+    A spatial index over the LED coordinates. All queries return a sorted numpy array of led ids so effects only
+    touch the LEDs they light up instead of scanning every coordinate.
+    """
+
+    def __init__(self, coordinates: CoordinateStore):
+        store = CoordinateStore.from_dict(coordinates)
+        self.led_ids = store.led_ids.copy()
+        self.points = store.points.astype(float)
+
+        self._tree = cKDTree(self.points)
+        # Per axis ordering of the points so slabs are two binary searches.
+        self._order = np.argsort(self.points, axis=0, kind="stable")
+        self._sorted = np.take_along_axis(self.points, self._order, axis=0)
+
+    def __len__(self):
+        return len(self.led_ids)
+
+    def slab(self, axis, low, high):
+        """Returns the ids of the LEDs with `low <= coord.<axis> <= high`."""
+        a = AXES[axis]
+        start = np.searchsorted(self._sorted[:, a], low, side="left")
+        end = np.searchsorted(self._sorted[:, a], high, side="right")
+        return self._to_ids(self._order[start:end, a])
+
+    def sphere(self, center, radius):
+        """Returns the ids of the LEDs within `radius` of the `center` point."""
+        return self._to_ids(self._tree.query_ball_point(_as_point(center), radius))
+
+    def ray(self, origin, direction, radius):
+        """
+        Returns the ids of the LEDs within `radius` of the ray starting at `origin` and pointing along `direction`.
+        Points behind the origin are measured against the origin itself.
+        """
+        origin = np.asarray(_as_point(origin), dtype=float)
+        direction = np.asarray(_as_point(direction), dtype=float)
+        direction = direction / np.linalg.norm(direction)
+
+        offsets = self.points - origin
+        t = np.clip(offsets @ direction, 0, None)
+        dists = np.linalg.norm(offsets - np.outer(t, direction), axis=1)
+        return self._to_ids(np.flatnonzero(dists <= radius))
+
+    def k_nearest(self, point, k):
+        """Returns the ids of the `k` LEDs nearest to `point`, nearest first."""
+        k = min(k, len(self))
+        if k <= 0:
+            return np.empty(0, dtype=int)
+
+        _, idx = self._tree.query(_as_point(point), k=k)
+        return self.led_ids[np.atleast_1d(idx)]
+
+    def _to_ids(self, idx):
+        return self.led_ids[np.sort(np.asarray(idx, dtype=int))]
+
+
+def _as_point(p):
+    """Accepts either a Coord3d or an x/y/z sequence."""
+    if isinstance(p, Coord3d):
+        return [p.x, p.y, p.z]
+    return p
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""Turns the videos recorded by `s1_capture_images.py --video` into the per led images that s2 expects.
+
+Usage: python3 -m utils.video_decode tree_captures
+"""
+import argparse
+import glob
+import json
+import os
+
+import cv2
+import numpy as np
+
+# The frames are shrunk by this factor before measuring their brightness.
+BRIGHTNESS_SCALE = 8
+
+
+def read_frames(video_file):
+    """Yields the BGR frames of a video file in order."""
+    cap = cv2.VideoCapture(video_file)
+    try:
+        while True:
+            s, img = cap.read()
+            if not s:
+                break
+            yield img
+    finally:
+        cap.release()
+
+
+def frame_brightness(video_file):
+    """Returns the mean brightness of every frame of the video."""
+    brightness = []
+    for img in read_frames(video_file):
+        small = cv2.resize(img, None, fx=1 / BRIGHTNESS_SCALE, fy=1 / BRIGHTNESS_SCALE, interpolation=cv2.INTER_AREA)
+        brightness.append(small.mean())
+    return np.array(brightness)
+
+
+def find_offset(brightness, timestamps, schedule):
+    """
+    Returns the delay [s] between the schedule and the frames. The end of the sync flash is found in the frame
+    brightness and compared to when the schedule turned the leds off. This accounts for the camera latency and any
+    frames that were buffered before they were read.
+    """
+    threshold = (brightness.max() + np.median(brightness)) / 2
+    bright = brightness > threshold
+    if not bright.any():
+        raise ValueError("Sync flash not found in the video.")
+
+    first = int(np.argmax(bright))
+    after = np.flatnonzero(~bright[first:])
+    if not len(after):
+        raise ValueError("End of the sync flash not found in the video.")
+    return timestamps[first + after[0]] - schedule["sync"]
+
+
+def schedule_frames(schedule, timestamps, offset):
+    """
+    Returns a map of output file name to the index of the frame closest to the middle of the time it was lit. The
+    middle of the sync flash is saved as the all leds image and the middle of the dark period as the dark image.
+    """
+    angle = schedule["angle"]
+    period = schedule["period"]
+    times = {
+        f"leds_angle{angle:03}.jpg": schedule["sync"] / 2,
+        f"dark_{angle:03}.jpg": (schedule["sync"] + schedule["leds_start"]) / 2,
+    }
+    for led in range(schedule["start"], schedule["end"]):
+        times[f"led{led:03}_angle{angle:03}.jpg"] = schedule["leds_start"] + (led - schedule["start"] + .5) * period
+
+    timestamps = np.asarray(timestamps)
+    frames = {}
+    for file_name, t in times.items():
+        idx = int(np.clip(np.searchsorted(timestamps, t + offset), 1, len(timestamps) - 1))
+        # Pick whichever neighbor is closer in time.
+        frames[file_name] = idx - 1 if (t + offset) - timestamps[idx - 1] < timestamps[idx] - (t + offset) else idx
+    return frames
+
+
+def decode_video(video_file, out_folder=None):
+    """
+    Writes an image per led for the video and its schedule. Images are written next to the video unless an output
+    folder is given. Returns the number of images written.
+    """
+    with open(os.path.splitext(video_file)[0] + ".json", 'r') as f:
+        schedule = json.load(f)
+    timestamps = schedule["timestamps"]
+    out_folder = out_folder or os.path.dirname(video_file)
+    if not os.path.exists(out_folder):
+        os.makedirs(out_folder)
+
+    brightness = frame_brightness(video_file)
+    if len(brightness) != len(timestamps):
+        print(f"Warning: {video_file} has {len(brightness)} frames but {len(timestamps)} timestamps.")
+        timestamps = timestamps[:len(brightness)]
+
+    offset = find_offset(brightness, timestamps, schedule)
+    frames = schedule_frames(schedule, timestamps, offset)
+    print(f"{os.path.basename(video_file)}: {len(brightness)} frames, camera delay {offset * 1000:.0f}ms")
+
+    wanted = {}
+    for file_name, idx in frames.items():
+        wanted.setdefault(idx, []).append(file_name)
+
+    for idx, img in enumerate(read_frames(video_file)):
+        if not wanted:
+            break
+        if idx in wanted:
+            if schedule.get("rotate"):
+                img = cv2.rotate(img, cv2.ROTATE_90_COUNTERCLOCKWISE)
+            for file_name in wanted.pop(idx):
+                cv2.imwrite(os.path.join(out_folder, file_name), img)
+
+    return len(frames)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('folder', type=str, help='The folder with the video_angle###.avi / .json files.')
+    parser.add_argument('-o', '--output-folder', type=str, help='Where to write the images. Defaults to the folder.')
+    args = parser.parse_args()
+
+    video_files = sorted(glob.glob(os.path.join(args.folder, "video_angle*.avi")))
+    if not video_files:
+        print(f"No videos found in {args.folder}")
+        return
+
+    for video_file in video_files:
+        count = decode_video(video_file, args.output_folder)
+        print(f"Wrote {count} images for {os.path.basename(video_file)}")
+
+
+if __name__ == '__main__':
+    main()
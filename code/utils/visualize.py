@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 """Animates a baked animation CSV on top of the tree LED coordinates
 
-Usage: ./visualization/visualize.py coords_2021.csv examples/test.csv
+Usage: python3 -m utils.visualize coords_2021.csv examples/test.csv [--step 5] [--start 100] [--end 400]
 """
 import os.path
 
@@ -10,14 +10,19 @@ from matplotlib.animation import FuncAnimation
 import argparse
 import numpy as np
 
+from utils.frames import FrameSource
+
 class Animation:
-    def __init__(self, coords_path:str, animation_path:str, interval=33, verbose=True):
+    def __init__(self, coords_path:str, animation_path:str, interval=33, verbose=True, step=1, start=0, end=None):
         """Animation class that can show an animation csv on GIFT coordinates
 
         Args:
             coords_path (str): The path to the LED coordinates on the tree
             animation_path (str): path tho
             interval (int, optional): The update interval / how much the animation sleeps between frames [ms]. Defaults to 10.
+            step (int, optional): Only shows every step-th frame. Defaults to 1.
+            start (int, optional): The first frame to show. Defaults to 0.
+            end (int, optional): The frame to stop at (exclusive). Defaults to the end of the animation.
 
         Raises:
             ValueError: If the animation and coordinate sizes don't match
@@ -29,13 +34,13 @@ class Animation:
             print(f"Failed to read coordinates. \n {e}")
 
         try:
-            self.frames = self.load_csv(animation_path, header=True) / 255
+            self.frames = FrameSource(animation_path, header=True, step=step, start=start, end=end)
         except Exception as e:
             print(f"Failed to read frames. \n {e}")
 
         # Check that sizes match
         n_coords = coords.shape[0]
-        n_animation_coords = (self.frames.shape[1] - 1) / 3
+        n_animation_coords = (len(self.frames[0]) - 1) / 3 if len(self.frames) else n_coords
         if n_coords != n_animation_coords:
             raise ValueError(f"Number of LED's on tree ({n_coords}) does not match number of LED's in animation ({n_animation_coords})")
 
@@ -67,10 +72,10 @@ class Animation:
         """
         # Print frame info if verbose
         if self.verbose:
-            print(f"Frame {frame_idx:03} / {self.n_frames:03}", end="\r")
+            print(f"Frame {self.frames.frame_number(frame_idx):03} ({frame_idx:03} / {self.n_frames:03})", end="\r")
 
         # Get frame data
-        frame = self.frames[frame_idx][1:]
+        frame = self.frames[frame_idx][1:] / 255
         frame = frame.reshape(-1, 3)
 
         # Update colors
@@ -80,8 +85,8 @@ class Animation:
     @staticmethod
     def load_csv(path, header=False):
         """
-        Loads csv from a given path as numpy array. I couldn't use `np.loadtxt`, due to some weird unicode character
-        in the coords file.
+        Loads csv from a given path as numpy array. The file is read as `utf-8-sig` to drop the byte order mark at the
+        start of the coords file.
 
         Args:
             path (str): The path to the np array
@@ -91,12 +96,7 @@ class Animation:
             np.array: A numpy array holding the parsed data
         """
         print(f"Loading {path}")
-        with open(path) as f:
-            if header:
-                f.readline()
-            coords_raw = f.read().replace("\ufeff", "").strip()
-
-        return np.array([[float(c) for c in row.split(",")] for row in coords_raw.split("\n")])
+        return np.loadtxt(path, delimiter=",", skiprows=1 if header else 0, ndmin=2, encoding="utf-8-sig")
 
     @staticmethod
     def create_scaled_axis(coords):
@@ -134,21 +134,25 @@ class Animation:
         return fig, ax
 
 
-def animate_tree(coords_file, animation_file, interval=50):
+def animate_tree(coords_file, animation_file, interval=50, step=1, start=0, end=None):
     animation = Animation(
         coords_file,
         animation_file,
-        interval=interval
+        interval=interval,
+        step=step,
+        start=start,
+        end=end
     )
 
     animation.run()
 
 
-def draw(og_leds, led_maps=None, limit=None, with_labels=False):
+def draw(og_leds, led_maps=None, limit=None, with_labels=False, file_name=None):
     """
     Draws the tree in static 3D.
     og_leds is the main list of LEDs to draw.
     led_maps is a list of maps of leds with different characteristics (eg: plot outliers).
+    file_name saves the plot to the file instead of showing it.
     """
     if not led_maps:
         led_maps = []
@@ -238,11 +242,11 @@ def draw(og_leds, led_maps=None, limit=None, with_labels=False):
     # plt.gca().invert_zaxis()
     plt.gca().invert_yaxis()
 
-    plt.show()
+    _show(fig, file_name)
 
 
-def draw_distance_distribution(dists, threshold):
-    # Generate two normal distributions
+def draw_distance_distribution(dists, threshold, file_name=None):
+    """Draws a histogram of the distances between neighboring leds. file_name saves it instead of showing it."""
     fig = plt.figure()
     ax2 = fig.add_subplot()
 
@@ -254,4 +258,32 @@ def draw_distance_distribution(dists, threshold):
     min_ylim, max_ylim = plt.ylim()
     plt.text(percentile * 1.1, max_ylim * 0.9, f'P{threshold}: {percentile:.2f}')
 
-    plt.show()
+    _show(fig, file_name)
+
+
+def _show(fig, file_name=None):
+    """Shows the figure or, given a file name, saves it without opening a window."""
+    if file_name:
+        fig.savefig(file_name)
+        plt.close(fig)
+        print(f"Plot written to {os.path.abspath(file_name)}")
+    else:
+        plt.show()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('coords_file', type=str, help='The file with the tree coordinates.')
+    parser.add_argument('animation_file', type=str, help='The animation csv to preview.')
+    parser.add_argument('-i', '--interval', type=int, default=50, help='The time between frames [ms].')
+    parser.add_argument('-k', '--step', type=int, default=1, help='Only show every k-th frame.')
+    parser.add_argument('-s', '--start', type=int, default=0, help='The first frame to show.')
+    parser.add_argument('-e', '--end', type=int, default=None, help='The frame to stop at (exclusive).')
+    args = parser.parse_args()
+
+    animate_tree(args.coords_file, args.animation_file, interval=args.interval, step=args.step, start=args.start,
+                 end=args.end)
+
+
+if __name__ == '__main__':
+    main()